@@ -1,29 +1,47 @@
 import contextlib
+import sys
 
-from collections import namedtuple
-
-import blf
 import bmesh
 import bpy
-import gpu
-import mathutils
+import numpy as np
 
 from bpy.props import *
-from bpy_extras import view3d_utils
-from gpu_extras.batch import batch_for_shader
-
-
-PERSISTENT_VERT_ID_LAYER = "persistent_vert_id"
-PERSISTENT_EDGE_ID_LAYER = "persistent_edge_id"
-PERSISTENT_FACE_ID_LAYER = "persistent_face_id"
-
-SELECTION_VERT_LAYER = "iv_vert_selected"
-SELECTION_EDGE_LAYER = "iv_edge_selected"
-SELECTION_FACE_LAYER = "iv_face_selected"
 
-NO_ID_VALUE = -1
-
-Rect = namedtuple("Rect", "x0 y0 x1 y1")
+from .core import (
+    DOMAIN_LABELS,
+    DOMAINS,
+    ID_LAYERS,
+    MAX_ID_VALUE,
+    NO_ID_VALUE,
+    DomainIds,
+    IdDiff,
+    ObjectSnapshot,
+    allocate_new_ids,
+    bmesh_elements,
+    capture_domain_ids,
+    clear_mesh_ids,
+    clearable_elements,
+    diff_domain_ids,
+    diff_serials,
+    find_shared_ids,
+    format_id_ranges,
+    id_diffs,
+    id_snapshots,
+    iter_mesh_ids,
+    max_assigned_id,
+    parse_id_filter,
+    pending_elements,
+    read_bmesh_ids,
+    used_meshes,
+    write_bmesh_selection,
+    write_mesh_selection,
+)
+
+CLEAR_SCOPE_ITEMS = (
+    ("SELECTED", "Выделенные", "Удалить ID у выделенных элементов"),
+    ("ALL", "Все", "Удалить ID у всех элементов меша"),
+    ("LAYER", "Слой", "Удалить слой с ID целиком, освободив занимаемую им память"),
+)
 
 addon_keymaps = []
 
@@ -34,7 +52,8 @@ def register_mode_change_handler():
     """Регистрирует обработчик события смены режима"""
     global mode_change_handler
     if mode_change_handler is None:
-        mode_change_handler = bpy.app.handlers.depsgraph_update_post.append(check_mode_change)
+        mode_change_handler = check_mode_change
+        bpy.app.handlers.depsgraph_update_post.append(mode_change_handler)
         print("Mode change handler registered")
 
 
@@ -54,6 +73,8 @@ prev_mode = None
 def check_mode_change(scene, depsgraph):
     global prev_mode
 
+    track_geometry_updates(depsgraph)
+
     active_obj = bpy.context.view_layer.objects.active
     if active_obj is None:
         return
@@ -67,6 +88,35 @@ def check_mode_change(scene, depsgraph):
         prev_mode = current_mode
 
 
+def get_renderer():
+    """Возвращает класс отрисовки, импортируя модуль отрисовки при первом обращении"""
+    from .overlay import IVRenderer
+
+    return IVRenderer
+
+
+def track_geometry_updates(depsgraph) -> None:
+    """Помечает устаревшими снимки объектов, изменённых в этом обновлении depsgraph"""
+    cache = get_renderer().cache
+    for update in depsgraph.updates:
+        updated_id = update.id.original
+        if isinstance(updated_id, bpy.types.Object):
+            # Снимки хранятся в локальных координатах, перемещение объекта их не меняет
+            if not update.is_updated_geometry:
+                continue
+            cache.tag(updated_id.as_pointer())
+        elif isinstance(updated_id, bpy.types.Mesh):
+            cache.tag_mesh(updated_id.as_pointer())
+
+
+def poll_mesh_object(_, obj: bpy.types.Object) -> bool:
+    return obj.type == "MESH"
+
+
+class IVPinnedObject(bpy.types.PropertyGroup):
+    object: PointerProperty(name="Объект", type=bpy.types.Object, poll=poll_mesh_object)
+
+
 class IVProperties(bpy.types.PropertyGroup):
     running: BoolProperty(
         name="Работает", description="Включена ли визуализация индексов?", default=False
@@ -76,221 +126,352 @@ class IVProperties(bpy.types.PropertyGroup):
     show_faces: BoolProperty(
         name="Грани", description="Показывать индексы граней (плоскостей)", default=True
     )
+    targets: EnumProperty(
+        name="Объекты",
+        description="Для каких объектов показывать индексы",
+        items=(
+            ("ACTIVE", "Активный", "Только активный объект"),
+            ("SELECTED", "Выделенные", "Все выделенные mesh-объекты"),
+            ("PINNED", "Закреплённые", "Закреплённый набор объектов"),
+        ),
+        default="ACTIVE",
+    )
+    pinned_objects: CollectionProperty(type=IVPinnedObject)
+    declutter: BoolProperty(
+        name="Убирать наложения",
+        description="Скрывать подписи, перекрытые более близкими к камере",
+        default=True,
+    )
+    display_mode: EnumProperty(
+        name="Режим",
+        description="Способ отображения ID",
+        items=(
+            ("LABELS", "Подписи", "Подписи с ID выделенных элементов"),
+            (
+                "HEATMAP",
+                "Тепловая карта",
+                "Все элементы меша точками, цвет которых зависит от ID; "
+                "подписи только возле курсора",
+            ),
+        ),
+        default="LABELS",
+    )
+    point_size: FloatProperty(
+        name="Размер точек",
+        description="Размер точек тепловой карты",
+        default=4.0,
+        min=1.0,
+        max=20.0,
+    )
+    hover_radius: IntProperty(
+        name="Радиус подписей",
+        description="Радиус вокруг курсора в пикселях, внутри которого показываются подписи",
+        default=60,
+        min=0,
+        max=500,
+    )
+    id_filter: StringProperty(
+        name="Фильтр ID",
+        description="Диапазоны и списки ID через запятую или пробел: 10-20, 35, >100, <=5, 500-",
+        default="",
+    )
+    filter_selected_only: BoolProperty(
+        name="Только выделенные",
+        description="Применять фильтр только к выделенным элементам, иначе ко всем элементам меша",
+        default=False,
+    )
+    clear_scope: EnumProperty(
+        name="Область",
+        description="У каких элементов удалять ID",
+        items=CLEAR_SCOPE_ITEMS,
+        default="SELECTED",
+    )
+    show_diff: BoolProperty(
+        name="Подсветить сравнение",
+        description="Показывать результат сравнения со снимком ID вместо обычных подписей",
+        default=True,
+    )
 
 
-def get_canvas(_: bpy.context, pos: mathutils.Vector, ch_count: int, font_size: int) -> Rect:
-    width = ch_count * font_size * 1.0
-    height = font_size * 1.5
+class IVIdBlock(bpy.types.PropertyGroup):
+    # Имя, а не указатель: указатель считается пользователем и не дал бы удалить меш
+    mesh_name: StringProperty(name="Меш")
+    domain: EnumProperty(
+        name="Домен",
+        items=(("VERT", "Вершины", ""), ("EDGE", "Рёбра", ""), ("FACE", "Грани", "")),
+    )
+    start: IntProperty(name="Начало", description="Первый ID блока")
+    stop: IntProperty(name="Конец", description="ID, следующий за последним ID блока")
+    cursor: IntProperty(name="Следующий", description="Следующий свободный ID блока")
 
-    x0 = int(pos.x - width * 0.5)
-    y0 = int(pos.y - height * 0.5)
-    x1 = int(pos.x + width * 0.5)
-    y1 = int(pos.y + height * 0.5)
-    return Rect(x0, y0, x1, y1)
 
+def sync_allocator(allocator: "IVAllocator", context: bpy.context) -> None:
+    """Сдвигает счётчики за максимальные ID всех мешей, чтобы новые блоки не пересеклись с ними"""
+    if not allocator.enabled:
+        return
+    # ID, присвоенные в текущем сеансе Edit Mode, ещё не записаны в mesh.attributes
+    for obj in context.objects_in_mode:
+        obj.update_from_editmode()
+    for domain in DOMAINS:
+        top = max(
+            (max_assigned_id(ids) for _, ids in iter_mesh_ids(bpy.data.meshes, domain)), default=0
+        )
+        attr = f"next_{domain.lower()}_id"
+        setattr(allocator, attr, max(getattr(allocator, attr), min(top + 1, MAX_ID_VALUE)))
 
-class IVRenderer(bpy.types.Operator):
-    bl_idname = "view3d.iv_renderer"
-    bl_label = "Index renderer"
 
-    _handle = None
+class IVAllocator(bpy.types.PropertyGroup):
+    enabled: BoolProperty(
+        name="Общий счётчик ID",
+        description="Выдавать ID из непересекающихся блоков, общих для всех мешей сцены",
+        default=False,
+        update=sync_allocator,
+    )
+    block_size: IntProperty(
+        name="Размер блока",
+        description="Сколько ID резервируется за мешем за один раз",
+        default=4096,
+        min=1,
+    )
+    next_vert_id: IntProperty(name="Следующий ID вершины", default=1, min=1)
+    next_edge_id: IntProperty(name="Следующий ID ребра", default=1, min=1)
+    next_face_id: IntProperty(name="Следующий ID грани", default=1, min=1)
+    blocks: CollectionProperty(type=IVIdBlock)
 
-    @staticmethod
-    def handle_add(context: bpy.context) -> None:
-        if IVRenderer._handle is None:
-            IVRenderer._handle = bpy.types.SpaceView3D.draw_handler_add(
-                IVRenderer._draw_callback, (context,), "WINDOW", "POST_PIXEL"
-            )
 
-    @staticmethod
-    def handle_remove(context: bpy.context) -> None:
-        if IVRenderer._handle is not None:
-            bpy.types.SpaceView3D.draw_handler_remove(IVRenderer._handle, "WINDOW")
-            IVRenderer._handle = None
+class IVOperator(bpy.types.Operator):
+    bl_idname = "view3d.iv_op"
+    bl_label = "Визуализатор индексов"
+    bl_description = "Включить/выключить визуализацию индексов"
+    bl_options = {"REGISTER", "UNDO"}
 
-    @staticmethod
-    def _draw_callback(context: bpy.context) -> None:
+    def execute(self, context: bpy.context):
+        props = context.scene.iv_props
+        if props.running:
+            get_renderer().handle_remove(context)
+            unregister_mode_change_handler()
+        else:
+            get_renderer().handle_add(context)
+            register_mode_change_handler()
+            bpy.ops.view3d.iv_cursor_tracker("INVOKE_DEFAULT")
+            active_obj = context.active_object
+            if active_obj and active_obj.mode == "EDIT":
+                update_selection_state(active_obj)
+        props.running = not props.running
+        context.region.tag_redraw()
+        return {"FINISHED"}
+
+
+class IVCursorTracker(bpy.types.Operator):
+    bl_idname = "view3d.iv_cursor_tracker"
+    bl_label = "IV Cursor Tracker"
+    bl_description = "Внутренний оператор для отслеживания курсора в режиме тепловой карты"
+    bl_options = {"INTERNAL"}
+
+    _running = False
+
+    def invoke(self, context: bpy.context, event: bpy.types.Event):
+        if IVCursorTracker._running:
+            return {"CANCELLED"}
+        IVCursorTracker._running = True
+        context.window_manager.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+    def modal(self, context: bpy.context, event: bpy.types.Event):
         props = context.scene.iv_props
         if not props.running:
-            return
+            IVCursorTracker._running = False
+            return {"FINISHED"}
 
-        if context.object is None:
-            return
+        if event.type == "MOUSEMOVE" and props.display_mode == "HEATMAP":
+            get_renderer().cursor = (event.mouse_x, event.mouse_y)
+            for area in context.window.screen.areas:
+                if area.type == "VIEW_3D":
+                    area.tag_redraw()
+        return {"PASS_THROUGH"}
 
-        obj = context.active_object
-        world_mat = obj.matrix_world
+    def cancel(self, context: bpy.context) -> None:
+        # Blender снимает модальные обработчики окна, например при загрузке файла
+        IVCursorTracker._running = False
 
-        vert_data = []
-        edge_data = []
-        face_data = []
 
-        if obj.type != "MESH":
-            return
+class IVPinSelectedOperator(bpy.types.Operator):
+    bl_idname = "view3d.iv_pin_selected"
+    bl_label = "Закрепить выделенные"
+    bl_description = "Закрепляет выделенные mesh-объекты для отображения индексов"
+    bl_options = {"REGISTER", "UNDO"}
 
-        mesh = obj.data
-        prev_mode = obj.mode
+    def execute(self, context: bpy.context):
+        props = context.scene.iv_props
+        props.pinned_objects.clear()
+        for obj in context.selected_objects:
+            if obj.type == "MESH":
+                props.pinned_objects.add().object = obj
+        props.targets = "PINNED"
+        context.area.tag_redraw()
+        self.report({"INFO"}, f"Закреплено объектов: {len(props.pinned_objects)}")
+        return {"FINISHED"}
 
-        need_mode_restore = False
 
-        if prev_mode != "EDIT":
-            selected_objects = [o for o in bpy.context.selected_objects]
-            active_object = bpy.context.view_layer.objects.active
+class IVClearPinnedOperator(bpy.types.Operator):
+    bl_idname = "view3d.iv_clear_pinned"
+    bl_label = "Открепить все"
+    bl_description = "Очищает закреплённый набор объектов"
+    bl_options = {"REGISTER", "UNDO"}
 
-            bpy.ops.object.mode_set(mode="EDIT")
-            need_mode_restore = True
+    def execute(self, context: bpy.context):
+        context.scene.iv_props.pinned_objects.clear()
+        context.area.tag_redraw()
+        return {"FINISHED"}
 
-        bm = bmesh.from_edit_mesh(mesh)
-        bm.verts.ensure_lookup_table()
-        bm.edges.ensure_lookup_table()
-        bm.faces.ensure_lookup_table()
 
-        try:
-            vert_id_layer = bm.verts.layers.int.get(PERSISTENT_VERT_ID_LAYER)
-            edge_id_layer = bm.edges.layers.int.get(PERSISTENT_EDGE_ID_LAYER)
-            face_id_layer = bm.faces.layers.int.get(PERSISTENT_FACE_ID_LAYER)
-
-            vert_sel_layer = bm.verts.layers.int.get(SELECTION_VERT_LAYER)
-            edge_sel_layer = bm.edges.layers.int.get(SELECTION_EDGE_LAYER)
-            face_sel_layer = bm.faces.layers.int.get(SELECTION_FACE_LAYER)
-
-            if prev_mode == "EDIT":
-                if props.show_verts and vert_id_layer is not None:
-                    for v in bm.verts:
-                        if v.select:
-                            try:
-                                persistent_id = v[vert_id_layer]
-                                if persistent_id > 0:
-                                    vert_data.append((persistent_id, world_mat @ v.co))
-                            except Exception as e:
-                                print(f"Err vert ID {v.index}: {e}")
-
-                if props.show_edges and edge_id_layer is not None:
-                    for e in bm.edges:
-                        if e.select:
-                            try:
-                                persistent_id = e[edge_id_layer]
-                                if persistent_id > 0:
-                                    center_coord = world_mat @ ((e.verts[0].co + e.verts[1].co) / 2)
-                                    edge_data.append((persistent_id, center_coord))
-                            except Exception as e:
-                                print(f"Err edge ID {e.index}: {e}")
-
-                if props.show_faces and face_id_layer is not None:
-                    for f in bm.faces:
-                        if f.select:
-                            try:
-                                persistent_id = f[face_id_layer]
-                                if persistent_id > 0:
-                                    center_coord = world_mat @ f.calc_center_median()
-                                    face_data.append((persistent_id, center_coord))
-                            except Exception as e:
-                                print(f"Error reading persistent ID for face {f.index}: {e}")
-            else:
-                if props.show_verts and vert_id_layer is not None and vert_sel_layer is not None:
-                    for v in bm.verts:
-                        try:
-                            was_selected = v[vert_sel_layer] == 1
-                            if was_selected:
-                                persistent_id = v[vert_id_layer]
-                                if persistent_id > 0:
-                                    vert_data.append((persistent_id, world_mat @ v.co))
-                        except Exception as e:
-                            print(f"Err vert ID {v.index}: {e}")
-
-                if props.show_edges and edge_id_layer is not None and edge_sel_layer is not None:
-                    for e in bm.edges:
-                        try:
-                            was_selected = e[edge_sel_layer] == 1
-                            if was_selected:
-                                persistent_id = e[edge_id_layer]
-                                if persistent_id > 0:
-                                    center_coord = world_mat @ ((e.verts[0].co + e.verts[1].co) / 2)
-                                    edge_data.append((persistent_id, center_coord))
-                        except Exception as e:
-                            print(f"Err edge ID {e.index}: {e}")
-
-                if props.show_faces and face_id_layer is not None and face_sel_layer is not None:
-                    for f in bm.faces:
-                        try:
-                            was_selected = f[face_sel_layer] == 1
-                            if was_selected:
-                                persistent_id = f[face_id_layer]
-                                if persistent_id > 0:
-                                    center_coord = world_mat @ f.calc_center_median()
-                                    face_data.append((persistent_id, center_coord))
-                        except Exception as e:
-                            print(f"Error reading persistent ID for face {f.index}: {e}")
-        finally:
-            bm.free()
-
-            if need_mode_restore:
-                bpy.ops.object.mode_set(mode=prev_mode)
-
-                bpy.context.view_layer.objects.active = active_object
-                for obj in bpy.context.selected_objects:
-                    obj.select_set(False)
-                for obj in selected_objects:
-                    obj.select_set(True)
-
-        if vert_data:
-            IVRenderer._render_data(context, vert_data)
-        if edge_data:
-            IVRenderer._render_data(context, edge_data)
-        if face_data:
-            IVRenderer._render_data(context, face_data)
+class CaptureIDSnapshotOperator(bpy.types.Operator):
+    bl_idname = "mesh.iv_capture_id_snapshot"
+    bl_label = "Снимок ID"
+    bl_description = "Запоминает ID и положения элементов активного меша для последующего сравнения"
+    bl_options = {"REGISTER"}
 
-    @staticmethod
-    def _render_data(context: bpy.context, data: list) -> None:
-        for item in data:
-            IVRenderer._render_single(context, item)
+    @classmethod
+    def poll(cls, context: bpy.context) -> bool:
+        return context.active_object is not None and context.active_object.type == "MESH"
 
-    @staticmethod
-    def _render_single(context: bpy.context, data: tuple) -> None:
-        index_str = str(data[0])
-        position = data[1]
-        sc = context.scene
+    def execute(self, context: bpy.context):
+        obj = context.active_object
+        snapshot = ObjectSnapshot(obj)
+        domains = {
+            domain: capture_domain_ids(domain_snapshot)
+            for domain, domain_snapshot in snapshot.domains.items()
+        }
+        id_snapshots[obj.data.name_full] = domains
+        id_diffs.pop(obj.data.name_full, None)
+        context.area.tag_redraw()
+
+        count = sum(len(domain_ids.ids) for domain_ids in domains.values())
+        size_kb = sum(d.ids.nbytes + d.anchors.nbytes for d in domains.values()) / 1024
+        self.report({"INFO"}, f"Снимок ID сохранён: {count} элементов, {size_kb:.1f} КБ")
+        return {"FINISHED"}
+
+
+class DiffIDSnapshotOperator(bpy.types.Operator):
+    bl_idname = "mesh.iv_diff_id_snapshot"
+    bl_label = "Сравнить со снимком"
+    bl_description = (
+        "Находит удалённые, добавленные и смещённые элементы относительно снимка ID "
+        "и сохраняет отчёт в текстовый блок"
+    )
+    bl_options = {"REGISTER"}
+
+    tolerance: FloatProperty(
+        name="Допуск смещения",
+        description="Элементы, сместившиеся больше чем на это расстояние, считаются смещёнными",
+        default=1e-4,
+        min=0.0,
+        subtype="DISTANCE",
+    )
+    filepath: StringProperty(
+        name="Файл отчёта",
+        description="Дополнительно записать отчёт в этот файл",
+        default="",
+        subtype="FILE_PATH",
+    )
 
-        region = context.region
-        region_3d = context.space_data.region_3d
-        loc_2d = view3d_utils.location_3d_to_region_2d(region, region_3d, position)
-        if not loc_2d:
-            return
+    @classmethod
+    def poll(cls, context: bpy.context) -> bool:
+        obj = context.active_object
+        return obj is not None and obj.type == "MESH" and obj.data.name_full in id_snapshots
 
-        rect = get_canvas(context, loc_2d, len(index_str), sc.iv_font_size)
-        shader = gpu.shader.from_builtin("UNIFORM_COLOR")
+    def invoke(self, context: bpy.context, event: bpy.types.Event):
+        return context.window_manager.invoke_props_dialog(self)
 
-        vertices = ((rect.x0, rect.y0), (rect.x0, rect.y1), (rect.x1, rect.y1), (rect.x1, rect.y0))
-        indices = ((0, 1, 2), (2, 3, 0))
-        batch = batch_for_shader(shader, "TRIS", {"pos": vertices}, indices=indices)
-        shader.bind()
-        shader.uniform_float("color", (*sc.iv_box_color[:3], sc.iv_box_color[3]))
-        batch.draw(shader)
+    def execute(self, context: bpy.context):
+        obj = context.active_object
+        before = id_snapshots[obj.data.name_full]
+        snapshot = ObjectSnapshot(obj)
+
+        empty = DomainIds(np.empty(0, dtype=np.int32), np.empty((0, 3), dtype=np.float32))
+        domains = {}
+        for domain in DOMAINS:
+            if domain not in before and domain not in snapshot.domains:
+                continue
+            after = snapshot.domains.get(domain)
+            domains[domain] = diff_domain_ids(
+                before.get(domain, empty),
+                capture_domain_ids(after) if after is not None else empty,
+                self.tolerance,
+            )
 
-        blf.size(0, sc.iv_font_size)
-        blf.position(0, rect.x0 + 5, rect.y0 + 5, 0)
-        blf.color(0, *sc.iv_text_color)
-        blf.draw(0, index_str)
+        id_diffs[obj.data.name_full] = IdDiff(next(diff_serials), self.tolerance, domains)
+        context.scene.iv_props.show_diff = True
+        context.area.tag_redraw()
 
+        report = self._format_report(obj, self.tolerance, domains)
+        text = bpy.data.texts.get("IV ID Diff") or bpy.data.texts.new("IV ID Diff")
+        text.from_string(report)
+        if self.filepath:
+            try:
+                with open(bpy.path.abspath(self.filepath), "w", encoding="utf-8") as f:
+                    f.write(report)
+            except OSError as e:
+                self.report({"ERROR"}, f"Не удалось записать отчёт в файл: {e}")
+
+        added = sum(len(diff.added) for diff in domains.values())
+        moved = sum(len(diff.moved) for diff in domains.values())
+        deleted = sum(len(diff.deleted) for diff in domains.values())
+        self.report(
+            {"INFO"},
+            f"Добавлено: {added}, смещено: {moved}, удалено: {deleted}. Отчёт: '{text.name}'",
+        )
+        return {"FINISHED"}
 
-class IVOperator(bpy.types.Operator):
-    bl_idname = "view3d.iv_op"
-    bl_label = "Визуализатор индексов"
-    bl_description = "Включить/выключить визуализацию индексов"
-    bl_options = {"REGISTER", "UNDO"}
+    @staticmethod
+    def _format_report(obj: bpy.types.Object, tolerance: float, domains: dict) -> str:
+        lines = [
+            f"Сравнение ID: {obj.name} ({obj.data.name})",
+            f"Допуск смещения: {tolerance}",
+        ]
+        for domain, diff in domains.items():
+            lines.append("")
+            lines.append(f"[{DOMAIN_LABELS[domain]}]")
+            lines.append(f"Удалено ({len(diff.deleted)}): {format_id_ranges(diff.deleted)}")
+            lines.append(f"Добавлено ({len(diff.added)}): {format_id_ranges(diff.added)}")
+            lines.append(f"Смещено ({len(diff.moved)}): {format_id_ranges(diff.moved)}")
+            lines.append(f"Повторяющихся ID: {diff.duplicates}")
+        return "\n".join(lines) + "\n"
+
+
+class ValidateSceneIDsOperator(bpy.types.Operator):
+    bl_idname = "scene.iv_validate_ids"
+    bl_label = "Проверить пересечения ID"
+    bl_description = "Проверяет, что ни один ID не используется сразу в нескольких мешах"
+    bl_options = {"REGISTER"}
 
     def execute(self, context: bpy.context):
-        props = context.scene.iv_props
-        if props.running:
-            IVRenderer.handle_remove(context)
-            unregister_mode_change_handler()
+        for obj in context.objects_in_mode:
+            obj.update_from_editmode()
+
+        # Осиротевшие меши (например, исходники после Ctrl+J) хранят старые ID и не проверяются
+        meshes = used_meshes(bpy.data.objects)
+        lines = ["Проверка пересечений ID между мешами"]
+        total_shared = 0
+        for domain in DOMAINS:
+            meshes_ids = list(iter_mesh_ids(meshes, domain))
+            shared, counts = find_shared_ids([ids for _, ids in meshes_ids])
+            total_shared += len(shared)
+
+            lines.append("")
+            lines.append(f"[{DOMAIN_LABELS[domain]}]")
+            lines.append(f"Общих ID ({len(shared)}): {format_id_ranges(shared)}")
+            for (mesh, _), count in zip(meshes_ids, counts):
+                if count:
+                    lines.append(f"  {mesh.name}: {count}")
+
+        text = bpy.data.texts.get("IV ID Validation") or bpy.data.texts.new("IV ID Validation")
+        text.from_string("\n".join(lines) + "\n")
+
+        if total_shared:
+            self.report({"WARNING"}, f"Найдено общих ID: {total_shared}. Отчёт: '{text.name}'")
         else:
-            IVRenderer.handle_add(context)
-            register_mode_change_handler()
-            active_obj = context.active_object
-            if active_obj and active_obj.mode == "EDIT":
-                update_selection_state(active_obj)
-        props.running = not props.running
-        context.region.tag_redraw()
+            self.report({"INFO"}, "Пересечений ID между мешами нет")
         return {"FINISHED"}
 
 
@@ -309,6 +490,31 @@ class IV_PT_Panel(bpy.types.Panel):
             layout.prop(props, "show_verts")
             layout.prop(props, "show_edges")
             layout.prop(props, "show_faces")
+            layout.prop(props, "declutter")
+            layout.prop(props, "id_filter")
+            if props.id_filter.strip():
+                try:
+                    if not parse_id_filter(props.id_filter):
+                        raise ValueError("Фильтр не задаёт ни одного ID")
+                except ValueError as e:
+                    row = layout.row()
+                    row.alert = True
+                    row.label(text=str(e), icon="ERROR")
+                layout.prop(props, "filter_selected_only")
+            layout.prop(props, "display_mode")
+            if props.display_mode == "HEATMAP":
+                layout.prop(props, "point_size")
+                layout.prop(props, "hover_radius")
+                layout.prop(context.scene, "iv_no_id_color", text="Цвет без ID")
+            layout.separator()
+            layout.prop(props, "targets")
+            if props.targets == "PINNED":
+                row = layout.row()
+                row.operator(IVPinSelectedOperator.bl_idname, text="Закрепить")
+                row.operator(IVClearPinnedOperator.bl_idname, text="Открепить")
+                for item in props.pinned_objects:
+                    if item.object is not None:
+                        layout.label(text=item.object.name, icon="OBJECT_DATA")
             layout.separator()
             layout.label(text="Присвоить постоянные ID:")
             row = layout.row()
@@ -317,21 +523,48 @@ class IV_PT_Panel(bpy.types.Panel):
             row.operator(AssignPersistentFaceIDsOperator.bl_idname, text="Грани")
 
             layout.label(text="Удалить ID:")
+            layout.prop(props, "clear_scope")
             row = layout.row()
-            row.operator(ClearVertIDsOperator.bl_idname, text="Вершины")
-            row.operator(ClearEdgeIDsOperator.bl_idname, text="Рёбра")
-            row.operator(ClearFaceIDsOperator.bl_idname, text="Грани")
+            row.operator(ClearVertIDsOperator.bl_idname, text="Вершины").scope = props.clear_scope
+            row.operator(ClearEdgeIDsOperator.bl_idname, text="Рёбра").scope = props.clear_scope
+            row.operator(ClearFaceIDsOperator.bl_idname, text="Грани").scope = props.clear_scope
+
+            layout.label(text="Сравнение ID:")
+            row = layout.row()
+            row.operator(CaptureIDSnapshotOperator.bl_idname, text="Снимок")
+            row.operator(DiffIDSnapshotOperator.bl_idname, text="Сравнить")
+            obj = context.active_object
+            if obj is not None and obj.type == "MESH" and obj.data.name_full in id_diffs:
+                layout.prop(props, "show_diff")
+
+            layout.separator()
+            allocator = context.scene.iv_allocator
+            layout.prop(allocator, "enabled")
+            if allocator.enabled:
+                layout.prop(allocator, "block_size")
+                col = layout.column(align=True)
+                col.label(text=f"Следующий блок вершин: {allocator.next_vert_id}")
+                col.label(text=f"Следующий блок рёбер: {allocator.next_edge_id}")
+                col.label(text=f"Следующий блок граней: {allocator.next_face_id}")
+            layout.operator(ValidateSceneIDsOperator.bl_idname, text="Проверить пересечения")
 
             layout.separator()
             layout.prop(context.scene, "iv_box_color", text="Цвет фона")
             layout.prop(context.scene, "iv_text_color", text="Цвет текста")
             layout.prop(context.scene, "iv_font_size", text="Размер шрифта")
+
+            if obj is not None and obj.type == "MESH":
+                layout.prop(obj, "iv_use_colors", text=f"Свои цвета для {obj.name}")
+                if obj.iv_use_colors:
+                    layout.prop(obj, "iv_box_color", text="Цвет фона")
+                    layout.prop(obj, "iv_text_color", text="Цвет текста")
         else:
             layout.operator(IVOperator.bl_idname, text="Запустить", icon="PLAY")
 
 
 def init_properties() -> None:
     bpy.types.Scene.iv_props = PointerProperty(type=IVProperties)
+    bpy.types.Scene.iv_allocator = PointerProperty(type=IVAllocator)
     bpy.types.Scene.iv_box_color = FloatVectorProperty(
         name="Цвет фона", subtype="COLOR", size=4, default=(0.0, 0.0, 0.0, 0.7), min=0.0, max=1.0
     )
@@ -339,19 +572,52 @@ def init_properties() -> None:
         name="Цвет текста", subtype="COLOR", size=4, default=(1.0, 1.0, 1.0, 1.0), min=0.0, max=1.0
     )
     bpy.types.Scene.iv_font_size = IntProperty(name="Размер шрифта", default=14, min=10, max=50)
+    bpy.types.Scene.iv_no_id_color = FloatVectorProperty(
+        name="Цвет без ID",
+        description="Цвет точек тепловой карты для элементов без ID",
+        subtype="COLOR",
+        size=4,
+        default=(1.0, 0.0, 1.0, 1.0),
+        min=0.0,
+        max=1.0,
+    )
+    bpy.types.Object.iv_use_colors = BoolProperty(
+        name="Свои цвета",
+        description="Использовать для объекта собственные цвета подписей вместо цветов сцены",
+        default=False,
+    )
+    bpy.types.Object.iv_box_color = FloatVectorProperty(
+        name="Цвет фона", subtype="COLOR", size=4, default=(0.0, 0.0, 0.0, 0.7), min=0.0, max=1.0
+    )
+    bpy.types.Object.iv_text_color = FloatVectorProperty(
+        name="Цвет текста", subtype="COLOR", size=4, default=(1.0, 1.0, 1.0, 1.0), min=0.0, max=1.0
+    )
 
 
 def clear_properties() -> None:
     del bpy.types.Scene.iv_props
+    del bpy.types.Scene.iv_allocator
     del bpy.types.Scene.iv_box_color
     del bpy.types.Scene.iv_text_color
     del bpy.types.Scene.iv_font_size
+    del bpy.types.Scene.iv_no_id_color
+    del bpy.types.Object.iv_use_colors
+    del bpy.types.Object.iv_box_color
+    del bpy.types.Object.iv_text_color
 
 
 def register() -> None:
+    bpy.utils.register_class(IVPinnedObject)
     bpy.utils.register_class(IVProperties)
-    bpy.utils.register_class(IVRenderer)
+    bpy.utils.register_class(IVIdBlock)
+    bpy.utils.register_class(IVAllocator)
     bpy.utils.register_class(IVOperator)
+    bpy.utils.register_class(IVCursorTracker)
+    bpy.utils.register_class(IVPinSelectedOperator)
+    bpy.utils.register_class(IVClearPinnedOperator)
+    bpy.utils.register_class(CaptureIDSnapshotOperator)
+    bpy.utils.register_class(DiffIDSnapshotOperator)
+    bpy.utils.register_class(ValidateSceneIDsOperator)
     bpy.utils.register_class(IV_PT_Panel)
     bpy.utils.register_class(AssignPersistentFaceIDsOperator)
     bpy.utils.register_class(AssignPersistentVertIDsOperator)
@@ -373,9 +639,9 @@ def register() -> None:
 def unregister() -> None:
     unregister_mode_change_handler()
 
-    if IVRenderer._handle is not None:
-        bpy.types.SpaceView3D.draw_handler_remove(IVRenderer._handle, "WINDOW")
-        IVRenderer._handle = None
+    overlay = sys.modules.get(f"{__package__}.overlay")
+    if overlay is not None:
+        overlay.IVRenderer.handle_remove(bpy.context)
 
     for km, kmi in addon_keymaps:
         km.keymap_items.remove(kmi)
@@ -384,8 +650,16 @@ def unregister() -> None:
     clear_properties()
     bpy.utils.unregister_class(IV_PT_Panel)
     bpy.utils.unregister_class(IVOperator)
-    bpy.utils.unregister_class(IVRenderer)
+    bpy.utils.unregister_class(IVCursorTracker)
+    bpy.utils.unregister_class(IVPinSelectedOperator)
+    bpy.utils.unregister_class(IVClearPinnedOperator)
+    bpy.utils.unregister_class(CaptureIDSnapshotOperator)
+    bpy.utils.unregister_class(DiffIDSnapshotOperator)
+    bpy.utils.unregister_class(ValidateSceneIDsOperator)
     bpy.utils.unregister_class(IVProperties)
+    bpy.utils.unregister_class(IVAllocator)
+    bpy.utils.unregister_class(IVIdBlock)
+    bpy.utils.unregister_class(IVPinnedObject)
     bpy.utils.unregister_class(AssignPersistentFaceIDsOperator)
     bpy.utils.unregister_class(AssignPersistentVertIDsOperator)
     bpy.utils.unregister_class(AssignPersistentEdgeIDsOperator)
@@ -395,6 +669,39 @@ def unregister() -> None:
     bpy.utils.unregister_class(ModeChangeHandler)
 
 
+def assign_selected_ids(context: bpy.context, obj: bpy.types.Object, domain: str) -> tuple:
+    """Присваивает ID выделенным элементам домена без ID в режиме редактирования
+
+    Возвращает число присвоенных ID и следующий ID.
+    """
+    mesh = obj.data
+    bm = bmesh.from_edit_mesh(mesh)
+    elements = bmesh_elements(bm, domain)
+    elements.ensure_lookup_table()
+
+    layer = elements.layers.int.get(ID_LAYERS[domain])
+    initialized_layer = layer is None
+    if initialized_layer:
+        layer = elements.layers.int.new(ID_LAYERS[domain])
+        for el in elements:
+            el[layer] = NO_ID_VALUE
+
+    ids, selected = read_bmesh_ids(elements, layer)
+    pending = pending_elements(ids, selected)
+    current_max_id = max_assigned_id(ids)
+    new_ids = allocate_new_ids(
+        context.scene.iv_allocator, mesh, domain, current_max_id, len(pending)
+    )
+    for index, new_id in zip(pending.tolist(), new_ids.tolist()):
+        elements[index][layer] = new_id
+
+    if len(pending) or initialized_layer:
+        bmesh.update_edit_mesh(mesh, loop_triangles=False, destructive=False)
+
+    next_id = int(new_ids[-1]) + 1 if len(new_ids) else current_max_id + 1
+    return len(pending), next_id
+
+
 class AssignPersistentFaceIDsOperator(bpy.types.Operator):
     bl_idname = "mesh.assign_persistent_face_ids"
     bl_label = "Присвоить постоянные ID граням"
@@ -411,78 +718,16 @@ class AssignPersistentFaceIDsOperator(bpy.types.Operator):
 
     def execute(self, context: bpy.context):
         obj = context.active_object
-        mesh = obj.data
-        bm = bmesh.from_edit_mesh(mesh)
-        bm.faces.ensure_lookup_table()
-        print("--- AssignPersistentFaceIDsOperator ---")
-
-        face_id_layer = bm.faces.layers.int.get(PERSISTENT_FACE_ID_LAYER)
-        initialized_layer = False
-        if face_id_layer is None:
-            print(f"Слой '{PERSISTENT_FACE_ID_LAYER}' не найден. Создаю и инициализирую.")
-            face_id_layer = bm.faces.layers.int.new(PERSISTENT_FACE_ID_LAYER)
-            for f in bm.faces:
-                try:
-                    f[face_id_layer] = NO_ID_VALUE
-                except Exception as e:
-                    print(f"Ошибка инициализации грани {f.index}: {e}")
-            initialized_layer = True
-        else:
-            print(f"Слой '{PERSISTENT_FACE_ID_LAYER}' найден.")
+        try:
+            assigned, next_id = assign_selected_ids(context, obj, "FACE")
+        except (ValueError, OverflowError) as e:
+            self.report({"ERROR"}, str(e))
+            return {"CANCELLED"}
 
-        current_max_id = 0
-        print("Сканирую существующие ID:")
-        face_ids_read = {}
-        for f in bm.faces:
-            try:
-                face_id = f[face_id_layer]
-                face_ids_read[f.index] = face_id
-                if face_id > 0:
-                    current_max_id = max(current_max_id, face_id)
-            except Exception as e:
-                print(f"Ошибка чтения ID грани {f.index}: {e}")
-                face_ids_read[f.index] = f"Ошибка: {e}"
-
-        print(f"Прочитанные ID: {face_ids_read}")
-        print(f"Максимальный существующий ID: {current_max_id}")
-
-        ids_assigned_this_run = {}
-        next_id_to_assign = current_max_id + 1 if current_max_id > 0 else 1
-        print(f"Следующий ID для присвоения: {next_id_to_assign}")
-        print("Присваиваю ID выделенным граням (если не назначен):")
-        for f in bm.faces:
-            if f.select:
-                try:
-                    current_id = f[face_id_layer]
-                    if current_id <= 0:
-                        print(
-                            f"  Присваиваю ID {next_id_to_assign} выделенной грани {f.index} (текущий ID: {current_id})"
-                        )
-                        f[face_id_layer] = next_id_to_assign
-                        ids_assigned_this_run[f.index] = next_id_to_assign
-                        next_id_to_assign += 1
-                    else:
-                        print(f"  Грани {f.index} уже присвоен ID {current_id}. Пропускаю.")
-
-                except Exception as e:
-                    print(f"Ошибка обработки выделенной грани {f.index}: {e}")
-
-        if ids_assigned_this_run or initialized_layer:
-            print("Обновляю меш...")
-            bmesh.update_edit_mesh(mesh, loop_triangles=False, destructive=False)
+        if assigned:
             context.area.tag_redraw()
-            print("Меш обновлён и перерисован.")
-        else:
-            print("Новых ID не присвоено и слой не инициализирован. Обновление не требуется.")
-
-        bm.free()
 
-        update_selection_state(obj)
-
-        report_message = f"ID обработаны. Присвоено: {len(ids_assigned_this_run)}. Следующий: {next_id_to_assign}"
-        self.report({"INFO"}, report_message)
-        print(report_message)
-        print("--- Оператор завершён ---")
+        self.report({"INFO"}, f"ID обработаны. Присвоено: {assigned}. Следующий: {next_id}")
         return {"FINISHED"}
 
 
@@ -504,68 +749,16 @@ class AssignPersistentVertIDsOperator(bpy.types.Operator):
 
     def execute(self, context: bpy.context):
         obj = context.active_object
-        mesh = obj.data
-        bm = bmesh.from_edit_mesh(mesh)
-        bm.verts.ensure_lookup_table()
-        print("--- AssignPersistentVertIDsOperator ---")
-
-        id_layer = bm.verts.layers.int.get(PERSISTENT_VERT_ID_LAYER)
-        initialized_layer = False
-        if id_layer is None:
-            print(f"Слой '{PERSISTENT_VERT_ID_LAYER}' не найден. Создаю...")
-            id_layer = bm.verts.layers.int.new(PERSISTENT_VERT_ID_LAYER)
-            for v in bm.verts:
-                try:
-                    v[id_layer] = NO_ID_VALUE
-                except Exception as e:
-                    print(f"Ошибка инициализации вершины {v.index}: {e}")
-            initialized_layer = True
-        else:
-            print(f"Слой '{PERSISTENT_VERT_ID_LAYER}' найден.")
+        try:
+            assigned, next_id = assign_selected_ids(context, obj, "VERT")
+        except (ValueError, OverflowError) as e:
+            self.report({"ERROR"}, str(e))
+            return {"CANCELLED"}
 
-        current_max_id = 0
-        for v in bm.verts:
-            try:
-                vert_id = v[id_layer]
-                if vert_id > 0:
-                    current_max_id = max(current_max_id, vert_id)
-            except Exception as e:
-                print(f"Ошибка чтения ID вершины {v.index}: {e}")
-        print(f"Максимальный существующий ID вершины: {current_max_id}")
-
-        ids_assigned_count = 0
-        next_id_to_assign = current_max_id + 1 if current_max_id > 0 else 1
-        print(f"Следующий ID для вершины: {next_id_to_assign}")
-        for v in bm.verts:
-            if v.select:
-                try:
-                    if v[id_layer] <= 0:
-                        print(f"  Присваиваю ID {next_id_to_assign} выделенной вершине {v.index}")
-                        v[id_layer] = next_id_to_assign
-                        next_id_to_assign += 1
-                        ids_assigned_count += 1
-                    else:
-                        print(f"  Вершине {v.index} уже присвоен ID {v[id_layer]}. Пропускаю.")
-                except Exception as e:
-                    print(f"Ошибка обработки вершины {v.index}: {e}")
-
-        if ids_assigned_count > 0 or initialized_layer:
-            print("Обновляю меш...")
-            bmesh.update_edit_mesh(mesh, loop_triangles=False, destructive=False)
+        if assigned:
             context.area.tag_redraw()
-            print("Меш обновлён.")
-        else:
-            print("Новых ID для вершин не присвоено.")
 
-        bm.free()
-
-        update_selection_state(obj)
-
-        self.report(
-            {"INFO"},
-            f"ID вершин обработаны. Присвоено: {ids_assigned_count}. Следующий: {next_id_to_assign}",
-        )
-        print("--- Vert Operator Finished ---")
+        self.report({"INFO"}, f"ID вершин обработаны. Присвоено: {assigned}. Следующий: {next_id}")
         return {"FINISHED"}
 
 
@@ -585,116 +778,80 @@ class AssignPersistentEdgeIDsOperator(bpy.types.Operator):
 
     def execute(self, context: bpy.context):
         obj = context.active_object
-        mesh = obj.data
-        bm = bmesh.from_edit_mesh(mesh)
-        bm.edges.ensure_lookup_table()
-        print("--- AssignPersistentEdgeIDsOperator ---")
-
-        id_layer = bm.edges.layers.int.get(PERSISTENT_EDGE_ID_LAYER)
-        initialized_layer = False
-        if id_layer is None:
-            print(f"Слой '{PERSISTENT_EDGE_ID_LAYER}' не найден. Создаю...")
-            id_layer = bm.edges.layers.int.new(PERSISTENT_EDGE_ID_LAYER)
-            for e in bm.edges:
-                try:
-                    e[id_layer] = NO_ID_VALUE
-                except Exception as err:
-                    print(f"Ошибка инициализации ребра {e.index}: {err}")
-            initialized_layer = True
-        else:
-            print(f"Слой '{PERSISTENT_EDGE_ID_LAYER}' найден.")
+        try:
+            assigned, next_id = assign_selected_ids(context, obj, "EDGE")
+        except (ValueError, OverflowError) as e:
+            self.report({"ERROR"}, str(e))
+            return {"CANCELLED"}
 
-        current_max_id = 0
-        for e in bm.edges:
-            try:
-                edge_id = e[id_layer]
-                if edge_id > 0:
-                    current_max_id = max(current_max_id, edge_id)
-            except Exception as err:
-                print(f"Ошибка чтения ID ребра {e.index}: {err}")
-        print(f"Максимальный существующий ID ребра: {current_max_id}")
-
-        ids_assigned_count = 0
-        next_id_to_assign = current_max_id + 1 if current_max_id > 0 else 1
-        print(f"Следующий ID для ребра: {next_id_to_assign}")
-        for e in bm.edges:
-            if e.select:
-                try:
-                    if e[id_layer] <= 0:
-                        print(f"  Присваиваю ID {next_id_to_assign} выделенному ребру {e.index}")
-                        e[id_layer] = next_id_to_assign
-                        next_id_to_assign += 1
-                        ids_assigned_count += 1
-                    else:
-                        print(f"  Рёбру {e.index} уже присвоен ID {e[id_layer]}. Пропускаю.")
-                except Exception as err:
-                    print(f"Ошибка обработки ребра {e.index}: {err}")
-
-        if ids_assigned_count > 0 or initialized_layer:
-            print("Обновляю меш...")
-            bmesh.update_edit_mesh(mesh, loop_triangles=False, destructive=False)
+        if assigned:
             context.area.tag_redraw()
-            print("Меш обновлён.")
-        else:
-            print("Новых ID для рёбер не присвоено.")
 
-        bm.free()
+        self.report({"INFO"}, f"ID рёбер обработаны. Присвоено: {assigned}. Следующий: {next_id}")
+        return {"FINISHED"}
 
-        update_selection_state(obj)
 
-        self.report(
-            {"INFO"},
-            f"ID рёбер обработаны. Присвоено: {ids_assigned_count}. Следующий: {next_id_to_assign}",
-        )
-        print("--- Edge Operator Finished ---")
-        return {"FINISHED"}
+def clear_ids(obj: bpy.types.Object, domain: str, scope: str) -> int | None:
+    """Удаляет ID домена у выделенных элементов, у всех элементов или вместе со слоем
+
+    В режиме редактирования перезаписываются только изменённые элементы.
+    Возвращает число удалённых ID или None, если слоя с ID нет.
+    """
+    mesh = obj.data
+    if obj.mode != "EDIT":
+        if mesh.attributes.get(ID_LAYERS[domain]) is None:
+            return None
+        return clear_mesh_ids(mesh, domain, scope)
+
+    bm = bmesh.from_edit_mesh(mesh)
+    elements = bmesh_elements(bm, domain)
+    layer = elements.layers.int.get(ID_LAYERS[domain])
+    if layer is None:
+        return None
+
+    ids, selected = read_bmesh_ids(elements, layer)
+    if scope == "LAYER":
+        elements.layers.int.remove(layer)
+        bmesh.update_edit_mesh(mesh, loop_triangles=False, destructive=False)
+        return int(np.count_nonzero(ids > 0))
+    if scope == "ALL":
+        selected[:] = True
+
+    cleared = clearable_elements(ids, selected)
+    if len(cleared):
+        elements.ensure_lookup_table()
+        for index in cleared.tolist():
+            elements[index][layer] = NO_ID_VALUE
+        bmesh.update_edit_mesh(mesh, loop_triangles=False, destructive=False)
+    return len(cleared)
 
 
 class ClearVertIDsOperator(bpy.types.Operator):
     bl_idname = "mesh.clear_persistent_vert_ids"
     bl_label = "Удалить ID вершин"
-    bl_description = "Удаляет постоянные ID у выделенных вершин"
+    bl_description = "Удаляет постоянные ID у выделенных вершин, у всех вершин или вместе со слоем"
     bl_options = {"REGISTER", "UNDO"}
 
+    scope: EnumProperty(name="Область", items=CLEAR_SCOPE_ITEMS, default="SELECTED")
+
     @classmethod
     def poll(cls, context: bpy.context) -> bool:
         return (
             context.active_object is not None
-            and context.active_object.mode == "EDIT"
+            and context.active_object.mode in {"EDIT", "OBJECT"}
             and context.active_object.type == "MESH"
         )
 
     def execute(self, context: bpy.context):
         obj = context.active_object
-        mesh = obj.data
-        bm = bmesh.from_edit_mesh(mesh)
-        bm.verts.ensure_lookup_table()
-        print("--- ClearVertIDsOperator ---")
-
-        id_layer = bm.verts.layers.int.get(PERSISTENT_VERT_ID_LAYER)
-        if id_layer is None:
+        cleared_count = clear_ids(obj, "VERT", self.scope)
+        if cleared_count is None:
             self.report({"INFO"}, "Слой с ID вершин не найден")
-            bm.free()
             return {"CANCELLED"}
 
-        cleared_count = 0
-        for v in bm.verts:
-            if v.select:
-                try:
-                    if v[id_layer] > 0:
-                        v[id_layer] = NO_ID_VALUE
-                        cleared_count += 1
-                except Exception as e:
-                    print(f"Ошибка при очистке ID вершины {v.index}: {e}")
-
-        if cleared_count > 0:
-            bmesh.update_edit_mesh(mesh, loop_triangles=False, destructive=False)
+        if cleared_count or self.scope == "LAYER":
             context.area.tag_redraw()
 
-        bm.free()
-
-        update_selection_state(obj)
-
         self.report({"INFO"}, f"Удалено ID у {cleared_count} вершин")
         return {"FINISHED"}
 
@@ -702,48 +859,29 @@ class ClearVertIDsOperator(bpy.types.Operator):
 class ClearEdgeIDsOperator(bpy.types.Operator):
     bl_idname = "mesh.clear_persistent_edge_ids"
     bl_label = "Удалить ID рёбер"
-    bl_description = "Удаляет постоянные ID у выделенных рёбер"
+    bl_description = "Удаляет постоянные ID у выделенных рёбер, у всех рёбер или вместе со слоем"
     bl_options = {"REGISTER", "UNDO"}
 
+    scope: EnumProperty(name="Область", items=CLEAR_SCOPE_ITEMS, default="SELECTED")
+
     @classmethod
     def poll(cls, context: bpy.context) -> bool:
         return (
             context.active_object is not None
-            and context.active_object.mode == "EDIT"
+            and context.active_object.mode in {"EDIT", "OBJECT"}
             and context.active_object.type == "MESH"
         )
 
     def execute(self, context: bpy.context):
         obj = context.active_object
-        mesh = obj.data
-        bm = bmesh.from_edit_mesh(mesh)
-        bm.edges.ensure_lookup_table()
-        print("--- ClearEdgeIDsOperator ---")
-
-        id_layer = bm.edges.layers.int.get(PERSISTENT_EDGE_ID_LAYER)
-        if id_layer is None:
+        cleared_count = clear_ids(obj, "EDGE", self.scope)
+        if cleared_count is None:
             self.report({"INFO"}, "Слой с ID рёбер не найден")
-            bm.free()
             return {"CANCELLED"}
 
-        cleared_count = 0
-        for e in bm.edges:
-            if e.select:
-                try:
-                    if e[id_layer] > 0:
-                        e[id_layer] = NO_ID_VALUE
-                        cleared_count += 1
-                except Exception as e:
-                    print(f"Ошибка при очистке ID ребра {e.index}: {e}")
-
-        if cleared_count > 0:
-            bmesh.update_edit_mesh(mesh, loop_triangles=False, destructive=False)
+        if cleared_count or self.scope == "LAYER":
             context.area.tag_redraw()
 
-        bm.free()
-
-        update_selection_state(obj)
-
         self.report({"INFO"}, f"Удалено ID у {cleared_count} рёбер")
         return {"FINISHED"}
 
@@ -751,88 +889,44 @@ class ClearEdgeIDsOperator(bpy.types.Operator):
 class ClearFaceIDsOperator(bpy.types.Operator):
     bl_idname = "mesh.clear_persistent_face_ids"
     bl_label = "Удалить ID граней"
-    bl_description = "Удаляет постоянные ID у выделенных граней"
+    bl_description = "Удаляет постоянные ID у выделенных граней, у всех граней или вместе со слоем"
     bl_options = {"REGISTER", "UNDO"}
 
+    scope: EnumProperty(name="Область", items=CLEAR_SCOPE_ITEMS, default="SELECTED")
+
     @classmethod
     def poll(cls, context: bpy.context) -> bool:
         return (
             context.active_object is not None
-            and context.active_object.mode == "EDIT"
+            and context.active_object.mode in {"EDIT", "OBJECT"}
             and context.active_object.type == "MESH"
         )
 
     def execute(self, context: bpy.context):
         obj = context.active_object
-        mesh = obj.data
-        bm = bmesh.from_edit_mesh(mesh)
-        bm.faces.ensure_lookup_table()
-        print("--- ClearFaceIDsOperator ---")
-
-        id_layer = bm.faces.layers.int.get(PERSISTENT_FACE_ID_LAYER)
-        if id_layer is None:
+        cleared_count = clear_ids(obj, "FACE", self.scope)
+        if cleared_count is None:
             self.report({"INFO"}, "Слой с ID граней не найден")
-            bm.free()
             return {"CANCELLED"}
 
-        cleared_count = 0
-        for f in bm.faces:
-            if f.select:
-                try:
-                    if f[id_layer] > 0:
-                        f[id_layer] = NO_ID_VALUE
-                        cleared_count += 1
-                except Exception as e:
-                    print(f"Ошибка при очистке ID грани {f.index}: {e}")
-
-        if cleared_count > 0:
-            bmesh.update_edit_mesh(mesh, loop_triangles=False, destructive=False)
+        if cleared_count or self.scope == "LAYER":
             context.area.tag_redraw()
 
-        bm.free()
-
-        update_selection_state(obj)
-
         self.report({"INFO"}, f"Удалено ID у {cleared_count} граней")
         return {"FINISHED"}
 
 
 def update_selection_state(obj):
-    """Обновляет состояние выделения в custom data layers"""
-    if obj is None or obj.type != "MESH" or obj.mode != "EDIT":
+    """Сохраняет выделение объекта в custom data layers"""
+    if obj is None or obj.type != "MESH":
         return
 
     mesh = obj.data
-    bm = bmesh.from_edit_mesh(mesh)
-    bm.verts.ensure_lookup_table()
-    bm.edges.ensure_lookup_table()
-    bm.faces.ensure_lookup_table()
-
-    vert_sel_layer = bm.verts.layers.int.get(SELECTION_VERT_LAYER)
-    if vert_sel_layer is None:
-        vert_sel_layer = bm.verts.layers.int.new(SELECTION_VERT_LAYER)
-
-    edge_sel_layer = bm.edges.layers.int.get(SELECTION_EDGE_LAYER)
-    if edge_sel_layer is None:
-        edge_sel_layer = bm.edges.layers.int.new(SELECTION_EDGE_LAYER)
-
-    face_sel_layer = bm.faces.layers.int.get(SELECTION_FACE_LAYER)
-    if face_sel_layer is None:
-        face_sel_layer = bm.faces.layers.int.new(SELECTION_FACE_LAYER)
-
-    for v in bm.verts:
-        v[vert_sel_layer] = 1 if v.select else 0
-
-    for e in bm.edges:
-        e[edge_sel_layer] = 1 if e.select else 0
-
-    for f in bm.faces:
-        f[face_sel_layer] = 1 if f.select else 0
-
-    bmesh.update_edit_mesh(mesh)
-    bm.free()
-
-    print("Состояние выделения обновлено")
+    if obj.mode == "EDIT":
+        if write_bmesh_selection(bmesh.from_edit_mesh(mesh)):
+            bmesh.update_edit_mesh(mesh, loop_triangles=False, destructive=False)
+    else:
+        write_mesh_selection(mesh)
 
 
 class ModeChangeHandler(bpy.types.Operator):
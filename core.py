@@ -0,0 +1,671 @@
+"""Логика ID, выделения и якорей элементов без зависимостей от GPU.
+
+Модуль работает с массивами numpy и данными мешей через foreach_get/foreach_set,
+поэтому его можно использовать в `blender --background` для пакетной обработки и
+замеров, не загружая модули отрисовки.
+"""
+
+from __future__ import annotations
+
+import functools
+import itertools
+import re
+
+from collections import namedtuple
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+
+if TYPE_CHECKING:
+    import bmesh
+    import bpy
+
+
+PERSISTENT_VERT_ID_LAYER = "persistent_vert_id"
+PERSISTENT_EDGE_ID_LAYER = "persistent_edge_id"
+PERSISTENT_FACE_ID_LAYER = "persistent_face_id"
+
+SELECTION_VERT_LAYER = "iv_vert_selected"
+SELECTION_EDGE_LAYER = "iv_edge_selected"
+SELECTION_FACE_LAYER = "iv_face_selected"
+
+NO_ID_VALUE = -1
+MAX_ID_VALUE = 2**31 - 1
+
+DOMAINS = ("VERT", "EDGE", "FACE")
+
+ID_LAYERS = {
+    "VERT": PERSISTENT_VERT_ID_LAYER,
+    "EDGE": PERSISTENT_EDGE_ID_LAYER,
+    "FACE": PERSISTENT_FACE_ID_LAYER,
+}
+
+SELECTION_LAYERS = {
+    "VERT": SELECTION_VERT_LAYER,
+    "EDGE": SELECTION_EDGE_LAYER,
+    "FACE": SELECTION_FACE_LAYER,
+}
+
+# Домены атрибутов меша, в которых хранятся слои bmesh
+ATTRIBUTE_DOMAINS = {"VERT": "POINT", "EDGE": "EDGE", "FACE": "FACE"}
+
+DOMAIN_LABELS = {"VERT": "Вершины", "EDGE": "Рёбра", "FACE": "Грани"}
+
+DIFF_CATEGORIES = ("added", "moved", "deleted")
+
+DomainSnapshot = namedtuple("DomainSnapshot", "ids selected anchors")
+DomainIds = namedtuple("DomainIds", "ids anchors")
+DomainDiff = namedtuple(
+    "DomainDiff", "added added_anchors moved moved_anchors deleted deleted_anchors duplicates"
+)
+IdDiff = namedtuple("IdDiff", "serial tolerance domains")
+
+# Снимки ID и результаты сравнения по имени меша; данные хранятся в массивах numpy
+id_snapshots = {}
+id_diffs = {}
+diff_serials = itertools.count(1)
+
+
+def mesh_elements(mesh: bpy.types.Mesh, domain: str):
+    if domain == "VERT":
+        return mesh.vertices
+    if domain == "EDGE":
+        return mesh.edges
+    return mesh.polygons
+
+
+def bmesh_elements(bm: bmesh.types.BMesh, domain: str):
+    if domain == "VERT":
+        return bm.verts
+    if domain == "EDGE":
+        return bm.edges
+    return bm.faces
+
+
+def _read_int_attribute(mesh: bpy.types.Mesh, name: str, count: int) -> np.ndarray | None:
+    attr = mesh.attributes.get(name)
+    if attr is None or attr.data_type != "INT" or len(attr.data) != count:
+        return None
+    values = np.empty(count, dtype=np.int32)
+    attr.data.foreach_get("value", values)
+    return values
+
+
+def read_mesh_ids(mesh: bpy.types.Mesh, domain: str) -> np.ndarray | None:
+    """Читает ID домена меша вне режима редактирования; None, если слоя нет"""
+    return _read_int_attribute(mesh, ID_LAYERS[domain], len(mesh_elements(mesh, domain)))
+
+
+def write_mesh_ids(mesh: bpy.types.Mesh, domain: str, ids: np.ndarray) -> None:
+    """Записывает ID домена меша одним вызовом foreach_set, создавая слой при необходимости"""
+    attr = mesh.attributes.get(ID_LAYERS[domain])
+    if attr is None:
+        attr = mesh.attributes.new(ID_LAYERS[domain], "INT", ATTRIBUTE_DOMAINS[domain])
+    attr.data.foreach_set("value", np.ascontiguousarray(ids, dtype=np.int32))
+    mesh.update()
+
+
+def read_mesh_selection(mesh: bpy.types.Mesh, domain: str) -> np.ndarray:
+    """Читает выделение домена: из сохранённого слоя выделения, а без него — из самого меша"""
+    elements = mesh_elements(mesh, domain)
+    selected = _read_int_attribute(mesh, SELECTION_LAYERS[domain], len(elements))
+    if selected is not None:
+        return selected == 1
+    selected = np.empty(len(elements), dtype=bool)
+    elements.foreach_get("select", selected)
+    return selected
+
+
+def write_mesh_selection(mesh: bpy.types.Mesh) -> bool:
+    """Сохраняет выделение меша вне режима редактирования в слои выделения
+
+    Каждый домен читается и пишется одним вызовом foreach_get/foreach_set, причём слой
+    перезаписывается, только если выделение изменилось. Возвращает True, если что-то записано.
+    """
+    changed = False
+    for domain in DOMAINS:
+        elements = mesh_elements(mesh, domain)
+        selected = np.empty(len(elements), dtype=bool)
+        elements.foreach_get("select", selected)
+        selected = selected.astype(np.int32)
+
+        name = SELECTION_LAYERS[domain]
+        if np.array_equal(_read_int_attribute(mesh, name, len(elements)), selected):
+            continue
+        attr = mesh.attributes.get(name)
+        if attr is None:
+            attr = mesh.attributes.new(name, "INT", ATTRIBUTE_DOMAINS[domain])
+        attr.data.foreach_set("value", selected)
+        changed = True
+    return changed
+
+
+def write_bmesh_selection(bm: bmesh.types.BMesh) -> bool:
+    """Сохраняет выделение bmesh в слои выделения, перезаписывая только изменившиеся элементы
+
+    Возвращает True, если что-то записано.
+    """
+    changed = False
+    for domain in DOMAINS:
+        elements = bmesh_elements(bm, domain)
+        layer = elements.layers.int.get(SELECTION_LAYERS[domain])
+        if layer is None:
+            layer = elements.layers.int.new(SELECTION_LAYERS[domain])
+            changed = True
+
+        stored, selected = read_bmesh_ids(elements, layer)
+        stale = np.flatnonzero(stored != selected)
+        if len(stale):
+            elements.ensure_lookup_table()
+            for index in stale.tolist():
+                elements[index][layer] = int(selected[index])
+            changed = True
+    return changed
+
+
+def read_bmesh_ids(elements, layer) -> tuple:
+    """Читает ID и выделение элементов bmesh в массивы"""
+    count = len(elements)
+    ids = np.fromiter((el[layer] for el in elements), dtype=np.int32, count=count)
+    selected = np.fromiter((el.select for el in elements), dtype=bool, count=count)
+    return ids, selected
+
+
+def max_assigned_id(ids: np.ndarray) -> int:
+    return max(int(ids.max()), 0) if len(ids) else 0
+
+
+def pending_elements(ids: np.ndarray, selected: np.ndarray) -> np.ndarray:
+    """Индексы выделенных элементов, которым ещё не присвоен ID"""
+    return np.flatnonzero(selected & (ids <= 0))
+
+
+def sequential_ids(current_max_id: int, count: int) -> np.ndarray:
+    """Продолжает нумерацию меша после его максимального ID"""
+    start = current_max_id + 1 if current_max_id > 0 else 1
+    if start + count - 1 > MAX_ID_VALUE:
+        raise ValueError(f"Нумерация ID исчерпана: нельзя выдать ещё {count} ID")
+    return np.arange(start, start + count, dtype=np.int64)
+
+
+def assign_mesh_ids(
+    mesh: bpy.types.Mesh, domain: str, selected_only: bool = True, allocate=sequential_ids
+) -> int:
+    """Присваивает ID элементам меша без ID вне режима редактирования
+
+    allocate(current_max_id, count) возвращает новые ID. Возвращает число присвоенных ID.
+    """
+    ids = read_mesh_ids(mesh, domain)
+    if ids is None:
+        ids = np.full(len(mesh_elements(mesh, domain)), NO_ID_VALUE, dtype=np.int32)
+    if selected_only:
+        selected = read_mesh_selection(mesh, domain)
+    else:
+        selected = np.ones(len(ids), dtype=bool)
+
+    pending = pending_elements(ids, selected)
+    ids[pending] = allocate(max_assigned_id(ids), len(pending))
+    write_mesh_ids(mesh, domain, ids)
+    return len(pending)
+
+
+def clearable_elements(ids: np.ndarray, selected: np.ndarray) -> np.ndarray:
+    """Индексы выделенных элементов, у которых есть ID"""
+    return np.flatnonzero((ids > 0) & selected)
+
+
+def clear_mesh_ids(mesh: bpy.types.Mesh, domain: str, scope: str = "SELECTED") -> int:
+    """Удаляет ID домена меша вне режима редактирования
+
+    scope: SELECTED — у выделенных элементов, ALL — у всех, LAYER — удаляет сам слой.
+    Меш перезаписывается, только если что-то изменилось. Возвращает число удалённых ID.
+    """
+    ids = read_mesh_ids(mesh, domain)
+    if scope == "LAYER":
+        attr = mesh.attributes.get(ID_LAYERS[domain])
+        if attr is None:
+            return 0
+        mesh.attributes.remove(attr)
+        mesh.update()
+        return 0 if ids is None else int(np.count_nonzero(ids > 0))
+    if ids is None:
+        return 0
+
+    if scope == "SELECTED":
+        selected = read_mesh_selection(mesh, domain)
+    else:
+        selected = np.ones(len(ids), dtype=bool)
+
+    cleared = clearable_elements(ids, selected)
+    if len(cleared):
+        ids[cleared] = NO_ID_VALUE
+        write_mesh_ids(mesh, domain, ids)
+    return len(cleared)
+
+
+def read_mesh_domains(mesh: bpy.types.Mesh) -> dict:
+    """Читает ID, выделение и якоря элементов меша вне режима редактирования"""
+    domains = {}
+    vert_co = None
+    for domain in DOMAINS:
+        ids = read_mesh_ids(mesh, domain)
+        if ids is None:
+            continue
+
+        elements = mesh_elements(mesh, domain)
+        count = len(elements)
+        selected = read_mesh_selection(mesh, domain)
+
+        if domain == "FACE":
+            anchors = np.empty(count * 3, dtype=np.float32)
+            elements.foreach_get("center", anchors)
+            anchors = anchors.reshape(-1, 3)
+        else:
+            if vert_co is None:
+                vert_co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+                mesh.vertices.foreach_get("co", vert_co)
+                vert_co = vert_co.reshape(-1, 3)
+            if domain == "VERT":
+                anchors = vert_co
+            else:
+                edge_verts = np.empty(count * 2, dtype=np.int32)
+                elements.foreach_get("vertices", edge_verts)
+                anchors = vert_co[edge_verts.reshape(-1, 2)].mean(axis=1)
+
+        domains[domain] = DomainSnapshot(ids, selected, anchors)
+    return domains
+
+
+def read_bmesh_domains(bm: bmesh.types.BMesh) -> dict:
+    """Читает ID, выделение и якоря элементов меша в режиме редактирования"""
+    domains = {}
+    vert_co = None
+    for domain in DOMAINS:
+        elements = bmesh_elements(bm, domain)
+        layer = elements.layers.int.get(ID_LAYERS[domain])
+        if layer is None:
+            continue
+
+        count = len(elements)
+        ids, selected = read_bmesh_ids(elements, layer)
+
+        if vert_co is None:
+            bm.verts.index_update()
+            vert_co = np.fromiter(
+                itertools.chain.from_iterable(v.co for v in bm.verts),
+                dtype=np.float32,
+                count=len(bm.verts) * 3,
+            ).reshape(-1, 3)
+
+        if domain == "VERT":
+            anchors = vert_co
+        elif domain == "EDGE":
+            edge_verts = np.fromiter(
+                (v.index for e in elements for v in e.verts), dtype=np.int32, count=count * 2
+            )
+            anchors = vert_co[edge_verts.reshape(-1, 2)].mean(axis=1)
+        elif count:
+            lengths = np.fromiter((len(f.verts) for f in elements), dtype=np.int64, count=count)
+            face_verts = np.fromiter(
+                (v.index for f in elements for v in f.verts),
+                dtype=np.int32,
+                count=int(lengths.sum()),
+            )
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            anchors = np.add.reduceat(vert_co[face_verts], starts, axis=0) / lengths[:, None]
+        else:
+            anchors = np.empty((0, 3), dtype=np.float32)
+
+        domains[domain] = DomainSnapshot(ids, selected, anchors)
+    return domains
+
+
+@functools.lru_cache(maxsize=32)
+def parse_id_filter(text: str) -> tuple:
+    """Разбирает фильтр ID в отсортированные непересекающиеся диапазоны (lo, hi) включительно
+
+    Поддерживаются записи: 35, 10-20, 10..20, 500-, >100, >=100, <5, <=5.
+    При ошибке разбора выбрасывается ValueError.
+    """
+    text = re.sub(r"\s*(-|\.\.)\s*", r"\1", text.strip())
+    text = re.sub(r"([<>]=?)\s+", r"\1", text)
+    ranges = []
+    for token in re.split(r"[,;\s]+", text):
+        if not token:
+            continue
+        match = re.fullmatch(r"(\d+)(?:(-|\.\.)(\d*))?|([<>]=?)(\d+)", token)
+        if match is None:
+            raise ValueError(f"Не удалось разобрать '{token}'")
+        start, separator, stop, operator, bound = match.groups()
+        if operator == ">":
+            low, high = int(bound) + 1, MAX_ID_VALUE
+        elif operator == ">=":
+            low, high = int(bound), MAX_ID_VALUE
+        elif operator == "<":
+            low, high = 1, int(bound) - 1
+        elif operator == "<=":
+            low, high = 1, int(bound)
+        elif separator is None:
+            low = high = int(start)
+        else:
+            low, high = int(start), int(stop) if stop else MAX_ID_VALUE
+        low, high = max(low, 1), min(high, MAX_ID_VALUE)
+        if low <= high:
+            ranges.append((low, high))
+
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return tuple(merged)
+
+
+def get_id_ranges(props) -> tuple | None:
+    """Возвращает диапазоны фильтра ID или None, если фильтр пуст или некорректен
+
+    Фильтр, не задающий ни одного диапазона (например, 0 или 20-10), даёт пустой кортеж.
+    """
+    if not props.id_filter.strip():
+        return None
+    try:
+        return parse_id_filter(props.id_filter)
+    except ValueError:
+        return None
+
+
+class IdIndex:
+    """Отсортированный индекс ID домена для поиска диапазонов бинарным поиском"""
+
+    __slots__ = ("order", "sorted_ids")
+
+    def __init__(self, ids: np.ndarray) -> None:
+        self.order = np.argsort(ids, kind="stable")
+        self.sorted_ids = ids[self.order]
+
+    def query(self, id_ranges: tuple) -> np.ndarray:
+        """Возвращает индексы элементов, чьи ID попадают в диапазоны, по возрастанию ID"""
+        bounds = np.array(id_ranges, dtype=np.int64).reshape(-1, 2)
+        starts = np.searchsorted(self.sorted_ids, bounds[:, 0], side="left")
+        ends = np.searchsorted(self.sorted_ids, bounds[:, 1], side="right")
+        counts = ends - starts
+        total = int(counts.sum())
+        if not total:
+            return np.empty(0, dtype=np.int64)
+        # Склеивает срезы order[start:end] всех диапазонов без цикла по диапазонам
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+        return self.order[positions]
+
+
+class ObjectSnapshot:
+    """Снимок ID одного объекта в локальных координатах"""
+
+    __slots__ = ("mesh_key", "mode", "domains", "version", "_labels", "_indices", "_spans")
+
+    def __init__(self, obj: bpy.types.Object) -> None:
+        self.mesh_key = obj.data.as_pointer()
+        self.mode = obj.mode
+        if obj.mode == "EDIT":
+            import bmesh
+
+            self.domains = read_bmesh_domains(bmesh.from_edit_mesh(obj.data))
+        else:
+            self.domains = read_mesh_domains(obj.data)
+        # Версия ID и якорей: не меняется, если снимок пересобран только из-за выделения
+        self.version = 0
+        self._labels = {}
+        self._indices = {}
+        self._spans = {}
+
+    def same_elements(self, other: ObjectSnapshot) -> bool:
+        """Совпадают ли ID и якоря всех доменов с другим снимком"""
+        return self.domains.keys() == other.domains.keys() and all(
+            np.array_equal(snapshot.ids, other.domains[domain].ids)
+            and np.array_equal(snapshot.anchors, other.domains[domain].anchors)
+            for domain, snapshot in self.domains.items()
+        )
+
+    def index(self, domain: str) -> IdIndex:
+        """Возвращает отсортированный индекс ID домена, строя его при первом обращении"""
+        index = self._indices.get(domain)
+        if index is None:
+            index = self._indices[domain] = IdIndex(self.domains[domain].ids)
+        return index
+
+    def id_span(self, domain: str) -> tuple | None:
+        """Возвращает наименьший и наибольший присвоенный ID домена; None, если ID нет"""
+        if domain not in self._spans:
+            snapshot = self.domains.get(domain)
+            assigned = snapshot.ids[snapshot.ids > 0] if snapshot is not None else ()
+            self._spans[domain] = (
+                (int(assigned.min()), int(assigned.max())) if len(assigned) else None
+            )
+        return self._spans[domain]
+
+    def labels(self, domains: tuple, selected_only: bool = True, id_ranges: tuple = None) -> tuple:
+        """Возвращает ID и локальные якоря элементов с присвоенным ID
+
+        При selected_only учитываются только выделенные элементы, при id_ranges — только
+        элементы с ID из этих диапазонов.
+        """
+        key = (domains, selected_only, id_ranges)
+        cached = self._labels.get(key)
+        if cached is None:
+            ids_parts = []
+            anchor_parts = []
+            for domain in domains:
+                snapshot = self.domains.get(domain)
+                if snapshot is None:
+                    continue
+                if id_ranges is not None:
+                    elements = self.index(domain).query(id_ranges)
+                    if selected_only:
+                        elements = elements[snapshot.selected[elements]]
+                else:
+                    elements = snapshot.ids > 0
+                    if selected_only:
+                        elements &= snapshot.selected
+                ids_parts.append(snapshot.ids[elements])
+                anchor_parts.append(snapshot.anchors[elements])
+            if ids_parts:
+                cached = (np.concatenate(ids_parts), np.concatenate(anchor_parts))
+            else:
+                cached = (np.empty(0, dtype=np.int32), np.empty((0, 3), dtype=np.float32))
+            self._labels[key] = cached
+        return cached
+
+
+class SnapshotCache:
+    """Кэш снимков по объектам.
+
+    Снимок пересчитывается только для объектов, о чьём изменении сообщил depsgraph,
+    поэтому стоимость кадра растёт с числом изменённых объектов, а не с их общим числом.
+    """
+
+    def __init__(self) -> None:
+        self._entries = {}
+        self._dirty = set()
+        self._versions = itertools.count(1)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._dirty.clear()
+
+    def tag(self, key: int) -> None:
+        self._dirty.add(key)
+
+    def tag_mesh(self, mesh_key: int) -> None:
+        for key, entry in self._entries.items():
+            if entry.mesh_key == mesh_key:
+                self._dirty.add(key)
+
+    def get(self, obj: bpy.types.Object) -> ObjectSnapshot:
+        key = obj.as_pointer()
+        entry = self._entries.get(key)
+        if (
+            entry is None
+            or key in self._dirty
+            or entry.mode != obj.mode
+            or entry.mesh_key != obj.data.as_pointer()
+        ):
+            previous = entry
+            entry = ObjectSnapshot(obj)
+            if previous is not None and previous.same_elements(entry):
+                entry.version = previous.version
+            else:
+                entry.version = next(self._versions)
+            self._entries[key] = entry
+            self._dirty.discard(key)
+        return entry
+
+    def prune(self, keys: set) -> None:
+        """Удаляет снимки объектов, которые больше не отображаются"""
+        for key in self._entries.keys() - keys:
+            del self._entries[key]
+        self._dirty &= keys
+
+
+def used_meshes(objects) -> list:
+    """Возвращает меши mesh-объектов без повторов; меши без пользователей-объектов пропускаются"""
+    return list(dict.fromkeys(obj.data for obj in objects if obj.type == "MESH"))
+
+
+def iter_mesh_ids(meshes, domain: str):
+    """Перебирает меши, у которых есть слой ID домена, вместе с их ID"""
+    for mesh in meshes:
+        ids = read_mesh_ids(mesh, domain)
+        if ids is not None:
+            yield mesh, ids
+
+
+def reserve_id_block(allocator, mesh: bpy.types.Mesh, domain: str, count: int, first_id: int = 1):
+    """Резервирует за мешем блок не меньше чем из count ID, начиная не раньше first_id, за O(1)
+
+    Блок обычно занимает block_size ID, но у верхней границы ID урезается до count.
+    """
+    attr = f"next_{domain.lower()}_id"
+    start = max(getattr(allocator, attr), first_id)
+    # stop и счётчик хранятся в IntProperty, поэтому тоже не должны превышать MAX_ID_VALUE
+    size = min(max(allocator.block_size, count), MAX_ID_VALUE - start)
+    if size < count:
+        raise ValueError(f"Общий счётчик ID исчерпан: нельзя зарезервировать ещё {count} ID")
+    setattr(allocator, attr, start + size)
+
+    block = allocator.blocks.add()
+    block.mesh_name = mesh.name_full
+    block.domain = domain
+    block.start = start
+    block.stop = start + size
+    block.cursor = start
+    return block
+
+
+def find_mesh_block(allocator, mesh: bpy.types.Mesh, domain: str):
+    """Возвращает последний блок меша в домене"""
+    for block in reversed(allocator.blocks):
+        if block.mesh_name == mesh.name_full and block.domain == domain:
+            return block
+    return None
+
+
+def allocate_new_ids(
+    allocator, mesh: bpy.types.Mesh, domain: str, current_max_id: int, count: int
+) -> np.ndarray:
+    """Выдаёт count новых ID домена меша
+
+    Без общего счётчика (allocator is None или выключен) нумерация продолжается после
+    current_max_id меша, с ним ID берутся из блоков меша, а при их нехватке
+    резервируется новый блок.
+    """
+    if allocator is None or not allocator.enabled:
+        return sequential_ids(current_max_id, count)
+
+    parts = []
+    # ID меша могли быть выданы в обход блока, пока счётчик был выключен
+    first_id = max(current_max_id, 0) + 1
+    block = find_mesh_block(allocator, mesh, domain)
+    if block is not None:
+        start = max(block.cursor, first_id)
+        take = max(min(count, block.stop - start), 0)
+        if take:
+            parts.append(np.arange(start, start + take, dtype=np.int64))
+            block.cursor = start + take
+            count -= take
+    if count > 0:
+        block = reserve_id_block(allocator, mesh, domain, count, first_id)
+        parts.append(np.arange(block.start, block.start + count, dtype=np.int64))
+        block.cursor += count
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+
+def find_shared_ids(meshes_ids: list) -> tuple:
+    """Находит ID, встречающиеся сразу в нескольких мешах
+
+    Принимает список массивов ID по мешам и возвращает отсортированные общие ID и
+    для каждого меша число его ID среди них.
+    """
+    unique_parts = [np.unique(ids[ids > 0]) for ids in meshes_ids]
+    if not unique_parts:
+        return np.empty(0, dtype=np.int32), []
+    merged = np.sort(np.concatenate(unique_parts))
+    shared = np.unique(merged[1:][merged[1:] == merged[:-1]])
+    counts = [int(np.isin(ids, shared, assume_unique=True).sum()) for ids in unique_parts]
+    return shared, counts
+
+
+def capture_domain_ids(snapshot: DomainSnapshot) -> DomainIds:
+    """Сохраняет присвоенные ID домена и их якоря, упорядоченные по ID"""
+    assigned = np.flatnonzero(snapshot.ids > 0)
+    ids = snapshot.ids[assigned]
+    order = np.argsort(ids, kind="stable")
+    anchors = np.ascontiguousarray(snapshot.anchors[assigned[order]], dtype=np.float32)
+    return DomainIds(ids[order], anchors)
+
+
+def _sorted_membership(values: np.ndarray, sorted_reference: np.ndarray) -> tuple:
+    """Для каждого значения возвращает признак наличия в отсортированном массиве и его позицию"""
+    positions = np.searchsorted(sorted_reference, values)
+    if not len(sorted_reference):
+        return np.zeros(len(values), dtype=bool), positions
+    clipped = np.minimum(positions, len(sorted_reference) - 1)
+    return sorted_reference[clipped] == values, clipped
+
+
+def diff_domain_ids(before: DomainIds, after: DomainIds, tolerance: float) -> DomainDiff:
+    """Сравнивает два снимка домена операциями над отсортированными массивами ID
+
+    При повторяющихся ID учитывается первый элемент с этим ID.
+    """
+    old_ids, old_first = np.unique(before.ids, return_index=True)
+    new_ids, new_first = np.unique(after.ids, return_index=True)
+    old_anchors = before.anchors[old_first]
+    new_anchors = after.anchors[new_first]
+
+    kept, new_positions = _sorted_membership(old_ids, new_ids)
+    present, _ = _sorted_membership(new_ids, old_ids)
+
+    offsets = old_anchors[kept] - new_anchors[new_positions[kept]]
+    moved = np.einsum("ij,ij->i", offsets, offsets) > tolerance * tolerance
+    moved_positions = new_positions[kept][moved]
+
+    return DomainDiff(
+        added=new_ids[~present],
+        added_anchors=new_anchors[~present],
+        moved=new_ids[moved_positions],
+        moved_anchors=new_anchors[moved_positions],
+        deleted=old_ids[~kept],
+        deleted_anchors=old_anchors[~kept],
+        duplicates=len(after.ids) - len(new_ids),
+    )
+
+
+def format_id_ranges(ids: np.ndarray) -> str:
+    """Записывает отсортированные уникальные ID диапазонами в формате фильтра ID"""
+    if not len(ids):
+        return "—"
+    breaks = np.flatnonzero(np.diff(ids) != 1) + 1
+    starts = ids[np.concatenate(([0], breaks))].tolist()
+    ends = ids[np.concatenate((breaks - 1, [len(ids) - 1]))].tolist()
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in zip(starts, ends))
@@ -0,0 +1,555 @@
+"""Отрисовка ID в 3D-вьюпорте.
+
+Модуль импортируется только при первом включении визуализации, чтобы регистрация
+аддона и фоновый режим Blender не загружали blf, gpu и gpu_extras.
+"""
+
+from collections import namedtuple
+from itertools import chain
+
+import blf
+import bpy
+import gpu
+import mathutils
+import numpy as np
+
+from gpu_extras.batch import batch_for_shader
+
+from .core import DIFF_CATEGORIES, DOMAINS, SnapshotCache, get_id_ranges, id_diffs
+
+
+# Градиент тепловой карты ID: от синего (меньшие ID) к красному (большие ID)
+HEATMAP_GRADIENT = np.array(
+    (
+        (0.05, 0.15, 0.9, 1.0),
+        (0.0, 0.75, 0.9, 1.0),
+        (0.1, 0.85, 0.2, 1.0),
+        (0.95, 0.85, 0.1, 1.0),
+        (0.9, 0.1, 0.05, 1.0),
+    ),
+    dtype=np.float32,
+)
+
+# Цвета фона подписей при подсветке сравнения: добавленные, смещённые, удалённые
+DIFF_BOX_COLORS = ((0.1, 0.55, 0.1, 0.85), (0.8, 0.55, 0.0, 0.85), (0.75, 0.1, 0.1, 0.85))
+
+# Отступ текста от края рамки подписи и высота рамки относительно размера шрифта
+LABEL_PADDING = 5
+LABEL_HEIGHT_SCALE = 1.5
+
+# Вершины двух треугольников рамки среди её углов (x0, y0), (x0, y1), (x1, y1), (x1, y0)
+BOX_TRIS = np.array(((0, 1, 2), (2, 3, 0)), dtype=np.int32)
+
+LabelSet = namedtuple("LabelSet", "parts ids world owners")
+ObjectLabels = namedtuple("ObjectLabels", "snapshot key ids world slots")
+RegionLabels = namedtuple("RegionLabels", "labels view_key ids screen depth owners texts offsets")
+PointBatch = namedtuple("PointBatch", "version key batch")
+
+
+class LabelMetrics:
+    """Строки подписей и их ширина, измеренная blf.dimensions.
+
+    Записи хранятся по ID и сбрасываются только при смене размера шрифта.
+    """
+
+    def __init__(self) -> None:
+        self.font_size = None
+        self.text_height = 0.0
+        self._entries = {}
+
+    def clear(self) -> None:
+        self.font_size = None
+        self._entries.clear()
+
+    def _use_font_size(self, font_size: int) -> None:
+        blf.size(0, font_size)
+        if font_size != self.font_size:
+            self.font_size = font_size
+            self.text_height = blf.dimensions(0, "0")[1]
+            self._entries.clear()
+
+    def _entry(self, label_id: int) -> tuple:
+        entry = self._entries.get(label_id)
+        if entry is None:
+            text = str(label_id)
+            entry = (text, blf.dimensions(0, text)[0] + 2 * LABEL_PADDING)
+            self._entries[label_id] = entry
+        return entry
+
+    def box_width(self, label_id: int, font_size: int) -> float:
+        """Ширина рамки подписи одного ID"""
+        self._use_font_size(font_size)
+        return self._entry(label_id)[1]
+
+    def layout(self, ids: np.ndarray, font_size: int) -> tuple:
+        """Возвращает строки подписей и смещения от точки привязки
+
+        Смещения по столбцам: углы рамки x0, y0, x1, y1 и позиция текста x, y.
+        """
+        self._use_font_size(font_size)
+        entries = [self._entry(label_id) for label_id in ids.tolist()]
+        texts = np.array([text for text, _ in entries], dtype=object)
+        widths = np.fromiter((width for _, width in entries), dtype=np.float32, count=len(texts))
+        half_height = font_size * LABEL_HEIGHT_SCALE * 0.5
+
+        offsets = np.empty((len(texts), 6), dtype=np.float32)
+        offsets[:, 0] = widths * -0.5
+        offsets[:, 1] = -half_height
+        offsets[:, 2] = widths * 0.5
+        offsets[:, 3] = half_height
+        offsets[:, 4] = offsets[:, 0] + LABEL_PADDING
+        offsets[:, 5] = self.text_height * -0.5
+        return texts, offsets
+
+
+def heatmap_colors(ids: np.ndarray, no_id_color: tuple, id_span: tuple) -> np.ndarray:
+    """Переводит ID в цвета градиента по диапазону id_span; элементы без ID получают no_id_color"""
+    colors = np.empty((len(ids), 4), dtype=np.float32)
+    assigned = ids > 0
+    colors[~assigned] = no_id_color
+    if assigned.any():
+        low, high = id_span
+        t = np.clip((ids[assigned] - low) / max(high - low, 1), 0.0, 1.0)
+        stops = np.linspace(0.0, 1.0, len(HEATMAP_GRADIENT))
+        for channel in range(4):
+            colors[assigned, channel] = np.interp(t, stops, HEATMAP_GRADIENT[:, channel])
+    return colors
+
+
+def merge_id_spans(snapshots: list, domains: tuple) -> dict:
+    """Объединяет диапазоны ID снимков по доменам, чтобы градиент был общим для всех объектов"""
+    spans = {}
+    for domain in domains:
+        domain_spans = [span for span in (s.id_span(domain) for s in snapshots) if span]
+        if domain_spans:
+            lows, highs = zip(*domain_spans)
+            spans[domain] = (min(lows), max(highs))
+    return spans
+
+
+def heatmap_points(snapshot, domains: tuple, no_id_color: tuple, spans: dict) -> tuple | None:
+    """Возвращает локальные координаты и цвета всех элементов снимка для тепловой карты"""
+    anchor_parts = []
+    color_parts = []
+    for domain in domains:
+        domain_snapshot = snapshot.domains.get(domain)
+        if domain_snapshot is None:
+            continue
+        anchor_parts.append(domain_snapshot.anchors)
+        id_span = spans.get(domain, (1, 1))
+        color_parts.append(heatmap_colors(domain_snapshot.ids, no_id_color, id_span))
+    if not anchor_parts:
+        return None
+    anchors = np.ascontiguousarray(np.concatenate(anchor_parts), dtype=np.float32)
+    return anchors, np.concatenate(color_parts)
+
+
+def transform_points(points: np.ndarray, matrix: mathutils.Matrix) -> np.ndarray:
+    mat = np.array(matrix, dtype=np.float32)
+    return points @ mat[:3, :3].T + mat[:3, 3]
+
+
+def project_points(points: np.ndarray, persp: mathutils.Matrix, width: int, height: int) -> tuple:
+    """Проецирует точки мира в координаты региона, как view3d_utils.location_3d_to_region_2d
+
+    Возвращает экранные координаты, глубину и маску точек, попавших в регион.
+    """
+    mat = np.array(persp, dtype=np.float32)
+    clip = points @ mat[:, :3].T + mat[:, 3]
+    depth = clip[:, 3]
+    visible = depth > 0.0
+    safe_depth = np.where(visible, depth, 1.0)
+    screen = np.empty((len(points), 2), dtype=np.float32)
+    screen[:, 0] = width * 0.5 + width * 0.5 * clip[:, 0] / safe_depth
+    screen[:, 1] = height * 0.5 + height * 0.5 * clip[:, 1] / safe_depth
+    visible &= (screen[:, 0] >= 0) & (screen[:, 0] <= width)
+    visible &= (screen[:, 1] >= 0) & (screen[:, 1] <= height)
+    return screen, depth, visible
+
+
+def declutter(screen: np.ndarray, depth: np.ndarray, cell_w: float, cell_h: float) -> np.ndarray:
+    """Оставляет по одной, ближайшей к камере, подписи на ячейку экранной сетки"""
+    order = np.argsort(depth, kind="stable")
+    cells = np.floor(screen[order] / (cell_w, cell_h)).astype(np.int64)
+    keys = (cells[:, 0] << 32) + cells[:, 1]
+    _, first = np.unique(keys, return_index=True)
+    return np.sort(order[first])
+
+
+def get_shown_domains(props) -> tuple:
+    return tuple(
+        domain
+        for domain, show in zip(DOMAINS, (props.show_verts, props.show_edges, props.show_faces))
+        if show
+    )
+
+
+def collect_target_objects(context: bpy.context) -> list:
+    props = context.scene.iv_props
+    if props.targets == "SELECTED":
+        objects = context.selected_objects
+    elif props.targets == "PINNED":
+        objects = [item.object for item in props.pinned_objects if item.object is not None]
+    else:
+        objects = [context.active_object] if context.active_object is not None else []
+    return [obj for obj in objects if obj.type == "MESH" and obj.visible_get()]
+
+
+def get_object_colors(scene: bpy.types.Scene, obj: bpy.types.Object) -> tuple:
+    if obj.iv_use_colors:
+        return tuple(obj.iv_box_color), tuple(obj.iv_text_color)
+    return tuple(scene.iv_box_color), tuple(scene.iv_text_color)
+
+
+class IVRenderer:
+    """Отрисовка ID во всех 3D-вьюпортах.
+
+    Извлечение данных из мешей выполняется один раз на изменение геометрии и
+    общее для всех регионов; подписи в мировых координатах кэшируются по объектам,
+    так что изменение одного объекта пересчитывает только его подписи. Проекция,
+    отсев наложений и раскладка подписей кэшируются отдельно для каждого региона по
+    его матрице вида и размеру, а рамки всех подписей рисуются одним батчем. В режиме
+    тепловой карты точки каждого объекта рисуются одним GPU-батчем, пересобираемым
+    только при смене ID или геометрии.
+    """
+
+    _handle = None
+    _points_handle = None
+    cache = SnapshotCache()
+    cursor = None
+    metrics = LabelMetrics()
+    _labels = None
+    _object_labels = {}
+    _regions = {}
+    _point_batches = {}
+
+    @staticmethod
+    def handle_add(context: bpy.context) -> None:
+        if IVRenderer._handle is None:
+            IVRenderer._handle = bpy.types.SpaceView3D.draw_handler_add(
+                IVRenderer._draw_callback, (), "WINDOW", "POST_PIXEL"
+            )
+        if IVRenderer._points_handle is None:
+            IVRenderer._points_handle = bpy.types.SpaceView3D.draw_handler_add(
+                IVRenderer._draw_points_callback, (), "WINDOW", "POST_VIEW"
+            )
+
+    @staticmethod
+    def handle_remove(context: bpy.context) -> None:
+        if IVRenderer._handle is not None:
+            bpy.types.SpaceView3D.draw_handler_remove(IVRenderer._handle, "WINDOW")
+            IVRenderer._handle = None
+        if IVRenderer._points_handle is not None:
+            bpy.types.SpaceView3D.draw_handler_remove(IVRenderer._points_handle, "WINDOW")
+            IVRenderer._points_handle = None
+        IVRenderer.cache.clear()
+        IVRenderer.cursor = None
+        IVRenderer.metrics.clear()
+        IVRenderer._labels = None
+        IVRenderer._object_labels.clear()
+        IVRenderer._regions.clear()
+        IVRenderer._point_batches.clear()
+
+    @staticmethod
+    def _draw_callback() -> None:
+        # Контекст берётся в момент отрисовки: callback вызывается для каждого региона
+        context = bpy.context
+        props = context.scene.iv_props
+        if not props.running:
+            return
+
+        labels = IVRenderer._collect_labels(context)
+        if labels is None:
+            return
+
+        region_labels = IVRenderer._project_labels(context, labels)
+        if props.display_mode == "HEATMAP":
+            region_labels = IVRenderer._hover_labels(context, region_labels)
+            if region_labels is None:
+                return
+        colors = [get_object_colors(context.scene, obj) for obj in collect_target_objects(context)]
+        text_color = tuple(context.scene.iv_text_color)
+        colors.extend((box_color, text_color) for box_color in DIFF_BOX_COLORS)
+        IVRenderer._render_labels(context, region_labels, colors)
+
+    @staticmethod
+    def _collect_labels(context: bpy.context) -> LabelSet | None:
+        """Собирает подписи всех целевых объектов в мировых координатах.
+
+        Результат общий для всех регионов; подписи каждого объекта берутся из его
+        кэша, и общий набор склеивается заново, только если изменился хотя бы один объект.
+        """
+        props = context.scene.iv_props
+        targets = collect_target_objects(context)
+        target_keys = {obj.as_pointer() for obj in targets}
+        IVRenderer.cache.prune(target_keys)
+        for key in IVRenderer._object_labels.keys() - target_keys:
+            del IVRenderer._object_labels[key]
+        if not targets:
+            return None
+
+        domains = get_shown_domains(props)
+        id_ranges = get_id_ranges(props)
+        if id_ranges is not None:
+            selected_only = props.filter_selected_only
+        else:
+            selected_only = props.display_mode == "LABELS"
+        parts = tuple(
+            IVRenderer._object_labels_of(
+                obj,
+                id_diffs.get(obj.data.name_full) if props.show_diff else None,
+                (domains, selected_only, id_ranges),
+            )
+            for obj in targets
+        )
+
+        labels = IVRenderer._labels
+        if (
+            labels is None
+            or len(labels.parts) != len(parts)
+            or any(old is not new for old, new in zip(labels.parts, parts))
+        ):
+            # Подсветка сравнения: слоты цветов после цветов объектов
+            owners = [
+                np.where(part.slots < 0, owner, len(targets) + part.slots).astype(np.int32)
+                for owner, part in enumerate(parts)
+            ]
+            labels = LabelSet(
+                parts,
+                np.concatenate([part.ids for part in parts]),
+                np.concatenate([part.world for part in parts]),
+                np.concatenate(owners),
+            )
+            IVRenderer._labels = labels
+            # Результаты регионов ссылаются на прежний набор подписей и больше не пригодятся
+            IVRenderer._regions.clear()
+        return labels if len(labels.ids) else None
+
+    @staticmethod
+    def _object_labels_of(obj: bpy.types.Object, diff, settings: tuple) -> ObjectLabels:
+        """Возвращает подписи объекта в мировых координатах
+
+        Пересчитываются только при смене снимка объекта, его матрицы, сравнения или
+        настроек отбора. slots: -1 для ID объекта, иначе номер категории сравнения.
+        """
+        snapshot = IVRenderer.cache.get(obj)
+        key = (
+            settings,
+            diff.serial if diff is not None else 0,
+            tuple(chain.from_iterable(obj.matrix_world)),
+        )
+        cached = IVRenderer._object_labels.get(obj.as_pointer())
+        if cached is not None and cached.snapshot is snapshot and cached.key == key:
+            return cached
+
+        domains, selected_only, id_ranges = settings
+        ids_parts = [np.empty(0, dtype=np.int32)]
+        anchor_parts = [np.empty((0, 3), dtype=np.float32)]
+        slot_parts = [np.empty(0, dtype=np.int32)]
+        if diff is not None:
+            for domain in domains:
+                domain_diff = diff.domains.get(domain)
+                if domain_diff is None:
+                    continue
+                for category, name in enumerate(DIFF_CATEGORIES):
+                    ids = getattr(domain_diff, name)
+                    ids_parts.append(ids)
+                    anchor_parts.append(getattr(domain_diff, f"{name}_anchors"))
+                    slot_parts.append(np.full(len(ids), category, dtype=np.int32))
+        else:
+            ids, anchors = snapshot.labels(domains, selected_only, id_ranges)
+            ids_parts.append(ids)
+            anchor_parts.append(anchors)
+            slot_parts.append(np.full(len(ids), -1, dtype=np.int32))
+
+        result = ObjectLabels(
+            snapshot,
+            key,
+            np.concatenate(ids_parts),
+            transform_points(np.concatenate(anchor_parts), obj.matrix_world),
+            np.concatenate(slot_parts),
+        )
+        IVRenderer._object_labels[obj.as_pointer()] = result
+        return result
+
+    @staticmethod
+    def _project_labels(context: bpy.context, labels: LabelSet) -> RegionLabels:
+        """Проецирует подписи в текущий регион, повторно используя прошлый результат региона
+
+        В режиме тепловой карты наложения не убираются: это делается уже для
+        подписей возле курсора.
+        """
+        props = context.scene.iv_props
+        font_size = context.scene.iv_font_size
+        region = context.region
+        region_3d = context.region_data
+        use_declutter = props.declutter and props.display_mode == "LABELS"
+        view_key = (
+            tuple(chain.from_iterable(region_3d.perspective_matrix)),
+            region.width,
+            region.height,
+            font_size,
+            props.display_mode,
+            use_declutter,
+        )
+
+        region_key = region.as_pointer()
+        cached = IVRenderer._regions.get(region_key)
+        if cached is not None and cached.labels is labels and cached.view_key == view_key:
+            return cached
+
+        screen, depth, visible = project_points(
+            labels.world, region_3d.perspective_matrix, region.width, region.height
+        )
+        keep = np.flatnonzero(visible)
+
+        if use_declutter and len(keep):
+            cell_w = IVRenderer.metrics.box_width(int(labels.ids[keep].max()), font_size)
+            cell_h = font_size * LABEL_HEIGHT_SCALE
+            keep = keep[declutter(screen[keep], depth[keep], cell_w, cell_h)]
+
+        # Тепловая карта раскладывает только подписи возле курсора
+        texts = offsets = None
+        if props.display_mode == "LABELS":
+            texts, offsets = IVRenderer.metrics.layout(labels.ids[keep], font_size)
+
+        result = RegionLabels(
+            labels,
+            view_key,
+            labels.ids[keep],
+            screen[keep],
+            depth[keep],
+            labels.owners[keep],
+            texts,
+            offsets,
+        )
+        IVRenderer._regions[region_key] = result
+        return result
+
+    @staticmethod
+    def _hover_labels(context: bpy.context, region_labels: RegionLabels) -> RegionLabels | None:
+        """Оставляет только подписи в радиусе вокруг курсора"""
+        if IVRenderer.cursor is None:
+            return None
+
+        props = context.scene.iv_props
+        region = context.region
+        cursor = np.array(
+            (IVRenderer.cursor[0] - region.x, IVRenderer.cursor[1] - region.y), dtype=np.float32
+        )
+        offsets = region_labels.screen - cursor
+        near = np.flatnonzero(np.einsum("ij,ij->i", offsets, offsets) <= props.hover_radius**2)
+        if not len(near):
+            return None
+
+        font_size = context.scene.iv_font_size
+        if props.declutter:
+            cell_w = IVRenderer.metrics.box_width(int(region_labels.ids[near].max()), font_size)
+            cell_h = font_size * LABEL_HEIGHT_SCALE
+            screen = region_labels.screen[near]
+            depth = region_labels.depth[near]
+            near = near[declutter(screen, depth, cell_w, cell_h)]
+
+        ids = region_labels.ids[near]
+        texts, offsets = IVRenderer.metrics.layout(ids, font_size)
+        return RegionLabels(
+            region_labels.labels,
+            region_labels.view_key,
+            ids,
+            region_labels.screen[near],
+            region_labels.depth[near],
+            region_labels.owners[near],
+            texts,
+            offsets,
+        )
+
+    @staticmethod
+    def _draw_points_callback() -> None:
+        context = bpy.context
+        props = context.scene.iv_props
+        if not props.running or props.display_mode != "HEATMAP":
+            return
+
+        targets = collect_target_objects(context)
+        IVRenderer._prune_point_batches({obj.as_pointer() for obj in targets})
+        domains = get_shown_domains(props)
+        no_id_color = tuple(context.scene.iv_no_id_color)
+
+        snapshots = [IVRenderer.cache.get(obj) for obj in targets]
+        spans = merge_id_spans(snapshots, domains)
+
+        shader = gpu.shader.from_builtin("POINT_FLAT_COLOR")
+        gpu.state.point_size_set(props.point_size)
+        for obj, snapshot in zip(targets, snapshots):
+            batch = IVRenderer._point_batch(obj, snapshot, shader, domains, no_id_color, spans)
+            if batch is None:
+                continue
+            with gpu.matrix.push_pop():
+                gpu.matrix.multiply_matrix(obj.matrix_world)
+                batch.draw(shader)
+        gpu.state.point_size_set(1.0)
+
+    @staticmethod
+    def _point_batch(
+        obj: bpy.types.Object,
+        snapshot,
+        shader: gpu.types.GPUShader,
+        domains: tuple,
+        no_id_color: tuple,
+        spans: dict,
+    ) -> gpu.types.GPUBatch | None:
+        """Возвращает батч точек объекта, пересобирая его только при смене ID или геометрии
+
+        Также батч пересобирается при смене общего для целевых объектов диапазона ID.
+        """
+        key = (domains, no_id_color, tuple(spans.get(domain) for domain in domains))
+        cached = IVRenderer._point_batches.get(obj.as_pointer())
+        if cached is not None and cached.version == snapshot.version and cached.key == key:
+            return cached.batch
+
+        points = heatmap_points(snapshot, domains, no_id_color, spans)
+        batch = None
+        if points is not None and len(points[0]):
+            anchors, colors = points
+            batch = batch_for_shader(shader, "POINTS", {"pos": anchors, "color": colors})
+        IVRenderer._point_batches[obj.as_pointer()] = PointBatch(snapshot.version, key, batch)
+        return batch
+
+    @staticmethod
+    def _prune_point_batches(keys: set) -> None:
+        for key in IVRenderer._point_batches.keys() - keys:
+            del IVRenderer._point_batches[key]
+
+    @staticmethod
+    def _render_labels(context: bpy.context, region_labels: RegionLabels, colors: list) -> None:
+        """Рисует рамки всех подписей одним батчем, затем их текст"""
+        count = len(region_labels.ids)
+        if not count:
+            return
+
+        # Смещения чередуют x и y, поэтому экранные позиции повторяются для каждой пары
+        placed = np.floor(region_labels.offsets + np.tile(region_labels.screen, 3))
+        corners = placed[:, (0, 1, 0, 3, 2, 3, 2, 1)].reshape(-1, 2)
+        indices = (np.arange(count, dtype=np.int32)[:, None, None] * 4 + BOX_TRIS).reshape(-1, 3)
+        box_colors = np.array([box_color for box_color, _ in colors], dtype=np.float32)
+        vertex_colors = np.repeat(box_colors[region_labels.owners], 4, axis=0)
+
+        shader = gpu.shader.from_builtin("SMOOTH_COLOR")
+        batch = batch_for_shader(
+            shader, "TRIS", {"pos": corners, "color": vertex_colors}, indices=indices
+        )
+        gpu.state.blend_set("ALPHA")
+        batch.draw(shader)
+        gpu.state.blend_set("NONE")
+
+        text_colors = [text_color for _, text_color in colors]
+        blf.size(0, context.scene.iv_font_size)
+        for text, x, y, owner in zip(
+            region_labels.texts.tolist(),
+            placed[:, 4].tolist(),
+            placed[:, 5].tolist(),
+            region_labels.owners.tolist(),
+        ):
+            blf.color(0, *text_colors[owner])
+            blf.position(0, x, y, 0)
+            blf.draw(0, text)